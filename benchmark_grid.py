@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Сравнение сборки сетки: create_video_grid против GridCompositor.
+
+Пример:
+    python benchmark_grid.py --cameras 4 --iterations 500
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from camera_utils import create_video_grid, GridCompositor, grid_layout
+
+
+def parse_size(value):
+    width, height = map(int, value.lower().split("x"))
+    return width, height
+
+
+def measure(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings_ms = np.array(timings) * 1000
+    return float(timings_ms.mean()), float(np.percentile(timings_ms, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сборки видеосетки")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--frame-size", type=parse_size, default=(640, 480),
+                        help="размер кадра камеры, например 640x480")
+    parser.add_argument("--output-size", type=parse_size, default=(640, 480),
+                        help="размер сетки, например 1280x960")
+    args = parser.parse_args()
+
+    grid_size = grid_layout(args.cameras)
+    rows, cols = grid_size
+    tile_size = (args.output_size[0] // cols, args.output_size[1] // rows)
+    frames = [np.random.randint(0, 255, (args.frame_size[1], args.frame_size[0], 3), dtype=np.uint8)
+              for _ in range(args.cameras)]
+
+    def old_pipeline():
+        # Как было в главном цикле: ресайз в тайл и сборка hstack/vstack
+        tiles = [cv2.resize(frame, tile_size) for frame in frames]
+        create_video_grid(tiles, grid_size, args.output_size)
+
+    compositor = GridCompositor(grid_size, args.output_size)
+
+    def compositor_all():
+        compositor.compose(frames)
+
+    def compositor_unchanged():
+        # Кадры не менялись - тайлы с тем же ключом пропускаются
+        for index, frame in enumerate(frames):
+            compositor.update_tile(index, frame, key=("static", index))
+
+    print(f"Сетка {rows}x{cols}, кадр {args.frame_size[0]}x{args.frame_size[1]}, "
+          f"холст {args.output_size[0]}x{args.output_size[1]}")
+    print(f"{'вариант':<32}{'мс':>8}{'p95 мс':>10}")
+    for name, func in (("resize + create_video_grid", old_pipeline),
+                       ("GridCompositor (все тайлы)", compositor_all),
+                       ("GridCompositor (без изменений)", compositor_unchanged)):
+        mean_ms, p95_ms = measure(func, args.iterations)
+        print(f"{name:<32}{mean_ms:>8.3f}{p95_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
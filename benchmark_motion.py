@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Сравнение движков детекции движения на записанных роликах.
+
+Пример:
+    python benchmark_motion.py clip1.mp4 clip2.mp4 --step 15 --labels labels.json
+
+labels.json (необязательно) - кадры с реальным движением для каждого ролика:
+    {"clip1.mp4": [[120, 340], [900, 1010]]}
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from motion_detection import MOTION_ENGINES, create_motion_detector
+
+
+def load_labels(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_size(value):
+    width, height = map(int, value.lower().split("x"))
+    return width, height
+
+
+def is_labeled_motion(frame_idx, ranges):
+    return any(start <= frame_idx <= end for start, end in ranges)
+
+
+def run_clip(clip_path, engine, args, ranges):
+    """Прогон одного ролика через один движок"""
+    cap = cv2.VideoCapture(clip_path)
+    if not cap.isOpened():
+        print(f"\033[91mНе удалось открыть ролик {clip_path}\033[0m")
+        return None
+
+    detector = create_motion_detector(engine, None, args.detection_size)
+    timings = []
+    checked = detected = 0
+    tp = fp = fn = 0
+    frame_idx = -1
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_idx += 1
+        # step эмулирует CHECK_INTERVAL: проверяется только каждый N-й кадр
+        if frame_idx % args.step:
+            continue
+
+        frame = cv2.resize(frame, (640, 480))
+        start = time.perf_counter()
+        motion, _ = detector.detect(frame, args.threshold, args.min_area)
+        timings.append(time.perf_counter() - start)
+
+        checked += 1
+        detected += motion
+        if ranges is not None:
+            actual = is_labeled_motion(frame_idx, ranges)
+            tp += motion and actual
+            fp += motion and not actual
+            fn += actual and not motion
+
+    cap.release()
+    if not timings:
+        return None
+
+    timings_ms = np.array(timings) * 1000
+    result = {
+        'frames': checked,
+        'mean_ms': float(timings_ms.mean()),
+        'p95_ms': float(np.percentile(timings_ms, 95)),
+        'motion_ratio': detected / checked,
+    }
+    if ranges is not None:
+        result['precision'] = tp / (tp + fp) if tp + fp else 0.0
+        result['recall'] = tp / (tp + fn) if tp + fn else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движков детекции движения")
+    parser.add_argument("clips", nargs="+", help="видеофайлы")
+    parser.add_argument("--engines", nargs="+", default=list(MOTION_ENGINES),
+                        choices=list(MOTION_ENGINES))
+    parser.add_argument("--threshold", type=int, default=25)
+    parser.add_argument("--min-area", type=int, default=500)
+    parser.add_argument("--step", type=int, default=1, help="проверять каждый N-й кадр")
+    parser.add_argument("--labels", help="JSON с интервалами кадров, где есть движение")
+    parser.add_argument("--detection-size", type=parse_size, default=None,
+                        help="разрешение детекции, например 320x240")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+
+    print(f"{'ролик':<24}{'движок':<10}{'кадров':>8}{'мс/кадр':>10}{'p95 мс':>10}"
+          f"{'движение':>10}{'precision':>11}{'recall':>8}")
+    for clip_path in args.clips:
+        ranges = labels.get(os.path.basename(clip_path))
+        for engine in args.engines:
+            result = run_clip(clip_path, engine, args, ranges)
+            if result is None:
+                continue
+            quality = (f"{result['precision']:>11.2f}{result['recall']:>8.2f}"
+                       if ranges is not None else f"{'-':>11}{'-':>8}")
+            print(f"{os.path.basename(clip_path):<24}{engine:<10}{result['frames']:>8}"
+                  f"{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                  f"{result['motion_ratio']:>10.1%}{quality}")
+
+
+if __name__ == "__main__":
+    main()
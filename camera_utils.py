@@ -1,4 +1,5 @@
 import cv2
+import math
 import numpy as np
 import os
 
@@ -44,6 +45,69 @@ def create_video_grid(frames, grid_size=(2, 2), output_size=(640, 480)):
     grid = np.vstack(rows[:grid_size[0]])
     return grid
 
+def grid_layout(count):
+    """Размер сетки (строки, столбцы) для count камер: почти квадратная"""
+    cols = max(1, math.ceil(math.sqrt(count)))
+    rows = max(1, math.ceil(count / cols))
+    return rows, cols
+
+class GridCompositor:
+    """
+    Сетка камер в одном заранее выделенном холсте.
+    Кадр каждой камеры уменьшается сразу в свой тайл (cv2.resize с dst),
+    тайлы, которые не менялись, не перерисовываются
+    """
+
+    def __init__(self, grid_size=(2, 2), output_size=(640, 480)):
+        rows, cols = grid_size
+        self.grid_size = grid_size
+        self.output_size = output_size
+        self.tile_size = (output_size[0] // cols, output_size[1] // rows)
+        self.canvas = np.zeros((output_size[1], output_size[0], 3), dtype=np.uint8)
+
+        tile_w, tile_h = self.tile_size
+        self.tiles = [
+            self.canvas[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w]
+            for r in range(rows) for c in range(cols)
+        ]
+        self.tile_keys = [None] * len(self.tiles)
+        self.tile_versions = [0] * len(self.tiles)
+
+    def update_tile(self, index, frame, key=None):
+        """
+        Запись кадра в тайл. key - признак содержимого: если он совпадает
+        с прежним, тайл не трогается. Возвращает True, если тайл перерисован
+        """
+        if key is not None and key == self.tile_keys[index]:
+            return False
+
+        tile = self.tiles[index]
+        if frame.shape[:2] == tile.shape[:2]:
+            tile[:] = frame
+        else:
+            resized = cv2.resize(frame, self.tile_size, dst=tile)
+            if resized is not tile:
+                tile[:] = resized
+        self.tile_keys[index] = key
+        self.tile_versions[index] += 1
+        return True
+
+    def clear_tile(self, index):
+        """Пустой (черный) тайл"""
+        if self.tile_keys[index] != "empty":
+            self.tiles[index][:] = 0
+            self.tile_keys[index] = "empty"
+            self.tile_versions[index] += 1
+
+    def compose(self, frames):
+        """Аналог create_video_grid: все кадры в холст, лишние тайлы очищаются"""
+        for index in range(len(self.tiles)):
+            if index < len(frames):
+                self.update_tile(index, frames[index])
+            else:
+                self.clear_tile(index)
+        return self.canvas
+
 def get_no_signal_frame(camera_idx, size=(640, 480)):
     """Создание кадра 'Нет сигнала'"""
     frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
@@ -70,6 +134,84 @@ def get_waiting_frame(camera_idx, time_left=None, size=(640, 480)):
                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
     return frame
 
+class PlaceholderCache:
+    """
+    Кэш кадров-заглушек "No signal" и "Waiting for motion".
+    Статичная часть (текст, маска) рисуется один раз на камеру, состояние и размер;
+    на каждом кадре перерисовывается только строка обратного отсчета и только
+    если число изменилось. Возвращаемые кадры общие - их нельзя изменять
+    """
+
+    COUNTDOWN_ORG = (240, 40)  # смещение строки отсчета от центра кадра по y
+    COUNTDOWN_FONT = (cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+
+    def __init__(self, size=(640, 480)):
+        self.size = size
+        self._entries = {}  # (state, camera_idx, size) -> заглушка
+        self._keys = {}     # id(кадра) -> (кадр, ключ текущего содержимого)
+
+    def _entry(self, state, camera_idx, mask):
+        cache_key = (state, camera_idx, self.size)
+        entry = self._entries.get(cache_key)
+        if entry is not None and entry['mask'] is mask:
+            return entry
+
+        if state == "no_signal":
+            base = get_no_signal_frame(camera_idx, self.size)
+        else:
+            base = get_waiting_frame(camera_idx, None, self.size)
+        if mask is not None:
+            # Для маски-массива overlay_mask возвращает новый кадр, а не рисует на base
+            base = overlay_mask(base, mask, in_place=True)
+
+        version = 0
+        if entry is not None:
+            version = entry['version'] + 1
+            self._keys.pop(id(entry['frame']), None)
+        entry = {'mask': mask, 'base': base, 'frame': base.copy(),
+                 'version': version, 'time_left': None}
+        self._entries[cache_key] = entry
+        self._keys[id(entry['frame'])] = (entry['frame'], cache_key + (version, None))
+        return entry
+
+    def _countdown_region(self):
+        font, scale, thickness = self.COUNTDOWN_FONT
+        (_, text_h), baseline = cv2.getTextSize("Next check: 0s", font, scale, thickness)
+        y = self.size[1] // 2 + self.COUNTDOWN_ORG[1]
+        top = max(0, y - text_h - thickness)
+        bottom = min(self.size[1], y + baseline + thickness)
+        return slice(top, bottom), slice(self.COUNTDOWN_ORG[0] - thickness, self.size[0])
+
+    def no_signal(self, camera_idx):
+        return self._entry("no_signal", camera_idx, None)['frame']
+
+    def waiting(self, camera_idx, time_left=None, mask=None):
+        entry = self._entry("waiting", camera_idx, mask)
+        frame = entry['frame']
+        if time_left == entry['time_left']:
+            return frame
+
+        # Восстанавливаем только полосу отсчета и рисуем новое число
+        rows, cols = self._countdown_region()
+        frame[rows, cols] = entry['base'][rows, cols]
+        if time_left is not None:
+            font, scale, thickness = self.COUNTDOWN_FONT
+            cv2.putText(frame, f"Next check: {time_left}s",
+                       (self.COUNTDOWN_ORG[0], self.size[1] // 2 + self.COUNTDOWN_ORG[1]),
+                       font, scale, (0, 0, 255), thickness)
+        entry['time_left'] = time_left
+        self._keys[id(frame)] = (frame, ("waiting", camera_idx, self.size, entry['version'], time_left))
+        return frame
+
+    def key_for(self, frame):
+        """Ключ содержимого для GridCompositor.update_tile; None - кадр не из кэша"""
+        cached = self._keys.get(id(frame))
+        if cached is None or cached[0] is not frame:
+            return None
+        return cached[1]
+
+placeholders = PlaceholderCache()
+
 class MaskCreator:
     def create_mask(self, camera_index, mask_name="default"):
         cap = cv2.VideoCapture(camera_index)
@@ -146,16 +288,85 @@ class MaskCreator:
                 cv2.destroyAllWindows()
                 return None
 
-def load_mask(mask_path):
-    """Загружает маску из файла"""
+def load_mask(mask_path, compiled=False):
+    """Загружает маску из файла (compiled=True - сразу подготовленную CompiledMask)"""
     if os.path.exists(mask_path):
-        return cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if compiled and mask is not None:
+            return compile_mask(mask)
+        return mask
     return None
 
-def overlay_mask(frame, mask, color=(0,255,0), alpha=0.3):
+class CompiledMask:
+    """
+    Маска, подготовленная один раз для каждого размера кадра:
+    тонированный слой для наложения, контур маски и ROI незамаскированной области
+    (белое на маске - исключенная зона)
+    """
+
+    def __init__(self, mask, color=(0, 255, 0), alpha=0.3):
+        self.mask = mask
+        self.color = color
+        self.alpha = alpha
+        self._layouts = {}  # {(w, h): dict}
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    def for_size(self, size):
+        """Все производные маски для кадра размера size = (w, h), считаются один раз"""
+        layout = self._layouts.get(size)
+        if layout is not None:
+            return layout
+
+        mask = self.mask
+        if (mask.shape[1], mask.shape[0]) != size:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+
+        # Область наложения - bounding box закрашенной части маски
+        bx, by, bw, bh = cv2.boundingRect(mask)
+        inside = mask[by:by + bh, bx:bx + bw]
+        color_layer = np.empty((bh, bw, 3), dtype=np.uint8)
+        color_layer[:] = self.color
+
+        outline, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        layout = {
+            'mask': mask,
+            'bbox': (bx, by, bw, bh),
+            'inside': inside,
+            'color_layer': color_layer,
+            'outline': outline,
+            # ROI, где детекция движения имеет смысл
+            'roi': cv2.boundingRect(cv2.bitwise_not(mask)),
+        }
+        self._layouts[size] = layout
+        return layout
+
+    def draw(self, frame):
+        """Наложение маски прямо на кадр: смешивание только внутри bounding box маски"""
+        layout = self.for_size((frame.shape[1], frame.shape[0]))
+        bx, by, bw, bh = layout['bbox']
+        if bw and bh:
+            region = frame[by:by + bh, bx:bx + bw]
+            blended = cv2.addWeighted(layout['color_layer'], self.alpha, region, 1 - self.alpha, 0)
+            cv2.copyTo(blended, layout['inside'], region)
+            cv2.drawContours(frame, layout['outline'], -1, self.color, 1)
+        return frame
+
+def compile_mask(mask, color=(0, 255, 0), alpha=0.3):
+    """Подготовка маски к быстрому наложению и обрезке по ROI"""
+    if mask is None or isinstance(mask, CompiledMask):
+        return mask
+    return CompiledMask(mask, color, alpha)
+
+def overlay_mask(frame, mask, color=(0,255,0), alpha=0.3, in_place=False):
     """Накладывает прозрачную маску на кадр"""
     if mask is None:
         return frame
+    if isinstance(mask, CompiledMask):
+        return mask.draw(frame if in_place else frame.copy())
     overlay = frame.copy()
     mask_3ch = cv2.merge([mask, mask, mask])
     color_layer = np.zeros_like(frame)
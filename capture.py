@@ -0,0 +1,159 @@
+import threading
+import time
+
+
+class CameraWorker:
+    """
+    Поток чтения одной камеры: постоянно вызывает cap.read() и хранит
+    в слоте только самый свежий кадр вместе со временем захвата
+    """
+
+    def __init__(self, camera_idx, cap, stale_timeout=1.0, new_frame_event=None):
+        self.camera_idx = camera_idx
+        self.cap = cap
+        self.stale_timeout = stale_timeout
+        self.new_frame_event = new_frame_event  # общий для всех камер сигнал "есть новый кадр"
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        # Слот с последним кадром
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._consumed_seq = 0
+        self._stale_seq = 0
+
+        # Счетчики
+        self.frames_captured = 0
+        self.dropped_frames = 0
+        self.stale_frames = 0
+        self.read_failures = 0
+
+    def start(self):
+        if self._thread is not None or not self.cap.isOpened():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"capture-{self.camera_idx}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            ret, frame = self.cap.read()
+            timestamp = time.time()
+            if not ret or frame is None:
+                with self._lock:
+                    self.read_failures += 1
+                time.sleep(0.01)
+                continue
+
+            with self._lock:
+                # Предыдущий кадр никто не забрал - он потерян
+                if self._seq > self._consumed_seq:
+                    self.dropped_frames += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self._seq += 1
+                self.frames_captured += 1
+            if self.new_frame_event is not None:
+                self.new_frame_event.set()
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        """
+        Неблокирующее чтение слота.
+        Возвращает (frame, timestamp, is_new); frame = None, если кадров еще не было
+        или последний кадр старше stale_timeout (такой кадр считается в stale_frames один раз)
+        """
+        with self._lock:
+            frame = self._frame
+            timestamp = self._timestamp
+            is_new = self._seq > self._consumed_seq
+            self._consumed_seq = self._seq
+
+            if frame is not None and time.time() - timestamp > self.stale_timeout:
+                if self._stale_seq != self._seq:
+                    self._stale_seq = self._seq
+                    self.stale_frames += 1
+                frame = None
+
+        if frame is None:
+            return None, timestamp, False
+        return frame, timestamp, is_new
+
+    def peek(self):
+        """
+        Последний кадр без отметки о прочтении (для других потребителей, например
+        потоков отдельных камер). Возвращает (frame, timestamp, seq); seq = 0 - кадров еще не было
+        """
+        with self._lock:
+            return self._frame, self._timestamp, self._seq
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'captured': self.frames_captured,
+                'dropped': self.dropped_frames,
+                'stale': self.stale_frames,
+                'read_failures': self.read_failures,
+                'age': time.time() - self._timestamp if self._seq else None,
+            }
+
+
+class CaptureManager:
+    """Набор потоков захвата: по одному CameraWorker на каждый cv2.VideoCapture"""
+
+    def __init__(self, caps, camera_indices, stale_timeout=1.0):
+        self._new_frame = threading.Event()
+        self.workers = {
+            camera_idx: CameraWorker(camera_idx, cap, stale_timeout, self._new_frame)
+            for camera_idx, cap in zip(camera_indices, caps)
+        }
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def is_opened(self, camera_idx):
+        worker = self.workers.get(camera_idx)
+        return worker is not None and worker.is_opened()
+
+    def wait_frame(self, timeout):
+        """
+        Ожидание нового кадра от любой камеры (не дольше timeout).
+        Сигнал сбрасывается, поэтому кадры, пришедшие после возврата, разбудят следующий вызов
+        """
+        ready = self._new_frame.wait(timeout)
+        self._new_frame.clear()
+        return ready
+
+    def read(self, camera_idx):
+        """Возвращает (frame, timestamp, is_new) для камеры, не дожидаясь cap.read()"""
+        worker = self.workers.get(camera_idx)
+        if worker is None:
+            return None, 0.0, False
+        return worker.read()
+
+    def peek(self, camera_idx):
+        """Возвращает (frame, timestamp, seq), не мешая основному циклу определять новые кадры"""
+        worker = self.workers.get(camera_idx)
+        if worker is None:
+            return None, 0.0, 0
+        return worker.peek()
+
+    def get_stats(self):
+        return {camera_idx: worker.get_stats() for camera_idx, worker in self.workers.items()}
@@ -1,10 +1,10 @@
 import socket
 import struct
-import pickle
 import cv2
 import json
 import threading
 import time
+import numpy as np
 
 def discover_server():
     possible_ips = ["192.168.1.100", "192.168.0.100"]
@@ -32,108 +32,433 @@ if HOST is None:
 
 PORT_VIDEO = 9999
 PORT_CMD = 9998
+VIDEO_MODE = "tiles"  # "tiles" - только изменившиеся тайлы, "grid" - вся сетка
+
+# Заголовок кадра - длина JPEG; заголовок тайла: длина JPEG, индекс, x, y, w, h,
+# ширина и высота холста
+FRAME_HEADER = struct.Struct(">L")
+TILE_HEADER = struct.Struct(">LBHHHHHH")
 
 print(f"Подключение к {HOST}")
 
-def video_receiver():
+class MessageReader:
+    """
+    Чтение сообщений "заголовок + JPEG" через recv_into прямо в переиспользуемые
+    буферы - без склейки bytes и срезов. Буфер заменяется только если кадр крупнее него
+    """
+
+    def __init__(self, sock, header=FRAME_HEADER):
+        self.sock = sock
+        self.header = header
+        self._header_buf = bytearray(header.size)
+
+    def _recv_exact(self, view):
+        while view:
+            try:
+                received = self.sock.recv_into(view)
+            except socket.timeout:
+                continue
+            if not received:
+                return False
+            view = view[received:]
+        return True
+
+    def read_header(self):
+        """Распакованный заголовок или None, если соединение закрыто"""
+        if not self._recv_exact(memoryview(self._header_buf)):
+            return None
+        return self.header.unpack(self._header_buf)
+
+    def read_payload(self, buffer, size):
+        """Чтение size байт в buffer; возвращает буфер (возможно, новый) или None"""
+        if len(buffer) < size:
+            buffer = bytearray(size + size // 2)
+        if not self._recv_exact(memoryview(buffer)[:size]):
+            return None
+        return buffer
+
+class LatestFrame:
+    """
+    Слот "самый свежий кадр" между потоком приема и потоком декодирования.
+    Три буфера по кругу: один принимается, один ждет в слоте, один декодируется.
+    Если декодер не успевает, кадр в слоте заменяется новым и считается пропущенным.
+    В режиме тайлов свежесть своя у каждого тайла (key): ждать может по одному
+    тайлу каждого индекса, недостающие буферы создаются по мере надобности
+    """
+
+    def __init__(self, buffers=3, buffer_size=256 * 1024):
+        self.buffer_size = buffer_size
+        self._cond = threading.Condition()
+        self._free = [bytearray(buffer_size) for _ in range(buffers)]
+        self._items = {}  # key -> (buffer, size, received_at, header)
+        self.closed = False
+
+        # Счетчики
+        self.received = 0
+        self.dropped = 0
+
+    def acquire(self):
+        with self._cond:
+            return self._free.pop() if self._free else bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        with self._cond:
+            self._free.append(buffer)
+
+    def put(self, buffer, size, received_at, header=None, key=None):
+        with self._cond:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._free.append(previous[0])
+                self.dropped += 1
+            self._items[key] = (buffer, size, received_at, header)
+            self.received += 1
+            self._cond.notify()
+
+    def take(self, timeout=0.1):
+        """
+        Все ждущие элементы [(buffer, size, received_at, header)] в порядке приема
+        или пустой список; буферы нужно вернуть через release()
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self.closed, timeout)
+            items = list(self._items.values())
+            self._items.clear()
+            return items
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+def open_video_socket(hello):
+    """Подключение к видео-серверу с приветствием (режим потока)"""
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    
+    client_socket.connect((HOST, PORT_VIDEO))
+    client_socket.settimeout(5.0)
+    client_socket.sendall(json.dumps(hello).encode("utf-8") + b"\n")
+    return client_socket
+
+def receive_frames(reader, slot, key=None):
+    """
+    Поток приема: только сеть, декодирование - в потоке отображения.
+    key(header) - ключ свежести (индекс тайла), None - весь кадр
+    """
+    try:
+        while not slot.closed:
+            header = reader.read_header()
+            if header is None:
+                break
+            size = header[0]
+            buffer = reader.read_payload(slot.acquire(), size)
+            if buffer is None:
+                break
+            slot.put(buffer, size, time.perf_counter(), header, key(header) if key else None)
+    except OSError as e:
+        if not slot.closed:
+            print(f"Ошибка видео: {e}")
+    finally:
+        slot.close()
+
+class StreamView:
+    """
+    Поток видео в своем окне. Прием идет в отдельном потоке, декодирование и показ -
+    в потоке Display; показывается всегда самое свежее. compose([(изображение, заголовок)])
+    собирает из декодированной пачки кадр для показа. На кадре - скорость приема и показа,
+    время декодирования и ожидания в слоте
+    """
+
+    def __init__(self, client_socket, window, compose, header=FRAME_HEADER, key=None, unit="fps"):
+        self.client_socket = client_socket
+        self.window = window
+        self.compose = compose
+        self.unit = unit
+        self.slot = LatestFrame()
+        receiver = threading.Thread(target=receive_frames,
+                                    args=(MessageReader(client_socket, header), self.slot, key))
+        receiver.daemon = True
+        receiver.start()
+
+        self.decode_ms = 0.0
+        self.wait_ms = 0.0
+        self.fps = 0.0
+        self.recv_fps = 0.0
+        self._fps_frames = 0
+        self._fps_received = 0
+        self._fps_start = time.perf_counter()
+
+    def show(self):
+        """Декодирование и показ ждущих сообщений; False, если показывать нечего"""
+        items = self.slot.take(timeout=0)
+        if not items:
+            return False
+
+        slot = self.slot
+        decode_start = time.perf_counter()
+        decoded = []
+        for buffer, size, received_at, message_header in items:
+            image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8, count=size), cv2.IMREAD_COLOR)
+            slot.release(buffer)
+            # Отдельно: ожидание в слоте после приема и само декодирование
+            self.wait_ms = 0.9 * self.wait_ms + 0.1 * (decode_start - received_at) * 1000
+            if image is None:
+                print("Ошибка декодирования кадра")
+                continue
+            decoded.append((image, message_header))
+        frame = self.compose(decoded) if decoded else None
+        now = time.perf_counter()
+        self.decode_ms = 0.9 * self.decode_ms + 0.1 * (now - decode_start) * 1000
+
+        # Принятые сообщения (включая пропущенные) и показанные кадры считаются раздельно
+        self._fps_frames += 1
+        if now - self._fps_start >= 1.0:
+            self.fps = self._fps_frames / (now - self._fps_start)
+            self.recv_fps = (slot.received - self._fps_received) / (now - self._fps_start)
+            self._fps_frames = 0
+            self._fps_received = slot.received
+            self._fps_start = now
+
+        if frame is None:
+            return True
+        cv2.putText(frame, f"recv {self.recv_fps:.1f} {self.unit}  shown {self.fps:.1f} fps  "
+                           f"decode {self.decode_ms:.1f} ms  wait {self.wait_ms:.1f} ms  dropped {slot.dropped}",
+                   (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 255, 255), 1)
+        cv2.imshow(self.window, frame)
+        return True
+
+    def close(self):
+        """Вызывается из потока Display"""
+        self.slot.close()
+        self.client_socket.close()
+        cv2.destroyWindow(self.window)
+        print(f"Видео {self.window}: принято {self.slot.received}, пропущено {self.slot.dropped}")
+
+class Display:
+    """
+    Единственный цикл HighGUI: OpenCV HighGUI не потокобезопасен, поэтому все окна
+    (сетка, тайлы, камеры) показываются только из потока run(). Другие потоки лишь
+    добавляют потоки видео через add(). 'q' закрывает последнее открытое окно
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = []
+
+    def add(self, view):
+        with self._lock:
+            self._views.append(view)
+
+    def run(self):
+        while True:
+            with self._lock:
+                views = list(self._views)
+            if not views:
+                time.sleep(0.1)
+                continue
+
+            shown = False
+            for view in views:
+                shown = view.show() or shown
+            closing = [view for view in views if view.slot.closed]  # соединение закрыто сервером
+            key = cv2.waitKey(1 if shown else 10) & 0xFF
+            if key == ord('q'):
+                closing.append(views[-1])
+            for view in closing:
+                with self._lock:
+                    if view not in self._views:
+                        continue
+                    self._views.remove(view)
+                view.close()
+
+display = Display()
+
+def video_receiver(hello=None, window="Raspberry Pi Surveillance"):
+    """Сетка или поток одной камеры: показывается самый свежий целый кадр"""
     try:
         print(f"Подключаюсь к {HOST}:{PORT_VIDEO}...")
-        client_socket.connect((HOST, PORT_VIDEO))
-        client_socket.settimeout(5.0)
+        client_socket = open_video_socket(hello or {"mode": "grid"})
         print("Подключено к видео-серверу!")
     except Exception as e:
         print(f"Ошибка подключения: {e}")
         return
 
-    data = b""
-    payload_size = struct.calcsize(">L")
+    display.add(StreamView(client_socket, window, lambda decoded: decoded[-1][0]))
 
+def tile_receiver(window="Raspberry Pi Surveillance"):
+    """
+    Режим тайлов: сервер присылает только изменившиеся тайлы, клиент дорисовывает свой холст.
+    Из тайлов одного индекса, принятых за время декодирования, рисуется последний
+    """
     try:
-        while True:
-            while len(data) < payload_size:
-                try:
-                    packet = client_socket.recv(4096)
-                    if not packet:
-                        return
-                    data += packet
-                except socket.timeout:
-                    continue
-
-            packed_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack(">L", packed_size)[0]
-
-            while len(data) < msg_size:
-                try:
-                    packet = client_socket.recv(4096)
-                    if not packet:
-                        return
-                    data += packet
-                except socket.timeout:
-                    continue
-
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
+        print(f"Подключаюсь к {HOST}:{PORT_VIDEO} (тайлы)...")
+        client_socket = open_video_socket({"mode": "tiles"})
+        print("Подключено к видео-серверу!")
+    except Exception as e:
+        print(f"Ошибка подключения: {e}")
+        return
+
+    canvas = None
+
+    def compose(decoded):
+        nonlocal canvas
+        # Размер холста - по самому свежему тайлу; тайлы старой раскладки пропускаются
+        canvas_w, canvas_h = decoded[-1][1][6:]
+        if canvas is None or canvas.shape[:2] != (canvas_h, canvas_w):
+            canvas = np.zeros((canvas_h, canvas_w, 3), dtype=np.uint8)
+        for tile, (_, _, x, y, w, h, tile_canvas_w, tile_canvas_h) in decoded:
+            if (tile_canvas_w, tile_canvas_h) != (canvas_w, canvas_h):
+                continue
+            if tile.shape[:2] != (h, w):
+                tile = cv2.resize(tile, (w, h))
+            canvas[y:y + h, x:x + w] = tile
+        # Показывается копия: строка метрик не должна остаться на холсте
+        return canvas.copy()
+
+    display.add(StreamView(client_socket, window, compose, TILE_HEADER,
+                           key=lambda header: header[1], unit="tiles/s"))
+
+def camera_receiver(camera_idx, size=None, quality=90):
+    """Поток одной камеры в исходном разрешении (size = (w, h) - уменьшенный) в отдельном окне"""
+    hello = {"camera": camera_idx, "quality": quality}
+    if size:
+        hello["width"], hello["height"] = size
+    video_receiver(hello, f"Camera {camera_idx}")
+
+class CommandChannel:
+    """
+    Одно долгоживущее соединение для команд. Сообщения - JSON через перевод строки,
+    у каждого запроса свой id, поэтому команды можно отправлять подряд,
+    не дожидаясь ответов; ответы по id раздает поток чтения
+    """
+
+    def __init__(self, host, port, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._next_id = 1
+        self._pending = {}  # id -> [Event, ответ]
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.settimeout(None)
+        self._sock = sock
+        reader = threading.Thread(target=self._read_loop, args=(sock,))
+        reader.daemon = True
+        reader.start()
+
+    def _read_loop(self, sock):
+        try:
+            for line in sock.makefile("rb"):
+                response = json.loads(line)
+                with self._lock:
+                    slot = self._pending.get(response.get("id"))
+                if slot is not None:
+                    slot[1] = response
+                    slot[0].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            # Соединение потеряно: ожидающие получат None, следующая команда переподключится
+            with self._lock:
+                if self._sock is sock:
+                    self._sock = None
+                for event, _ in self._pending.values():
+                    event.set()
+            sock.close()
 
+    def send(self, cmd):
+        """Отправка без ожидания ответа; возвращает id запроса"""
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = [threading.Event(), None]
+            message = json.dumps(dict(cmd, id=request_id)).encode("utf-8") + b"\n"
             try:
-                buffer = pickle.loads(frame_data)
-                frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
-
-                if frame is not None:
-                    cv2.imshow("Raspberry Pi Surveillance", frame)
-                else:
-                    print("Ошибка декодирования кадра")
-                    
-            except Exception as e:
-                print(f"Ошибка кадра: {e}")
-                
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+                self._sock.sendall(message)
+            except OSError:
+                del self._pending[request_id]
+                self._sock.close()
+                self._sock = None
+                raise
+        return request_id
 
-    except Exception as e:
-        print(f"Ошибка видео: {e}")
-    finally:
-        client_socket.close()
-        cv2.destroyAllWindows()
+    def wait(self, request_id, timeout=None):
+        """Ответ на запрос или None, если ответа нет (таймаут, обрыв соединения)"""
+        with self._lock:
+            slot = self._pending.get(request_id)
+        if slot is None:
+            return None
+        slot[0].wait(self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._pending.pop(request_id, None)
+        return slot[1]
+
+    def request(self, cmd, timeout=None):
+        return self.wait(self.send(cmd), timeout)
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+commands = CommandChannel(HOST, PORT_CMD)
 
 def send_command(cmd):
     try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.settimeout(5)
-        client_socket.connect((HOST, PORT_CMD))
-        client_socket.send(json.dumps(cmd).encode("utf-8"))
-        
-        response = client_socket.recv(1024)
-        if response:
-            print(f"Ответ: {json.loads(response.decode('utf-8'))}")
-                
+        response = commands.request(cmd)
+        if response is None:
+            print("Ошибка команды: нет ответа от сервера")
+        else:
+            print(f"Ответ: {response}")
+        return response
     except Exception as e:
         print(f"Ошибка команды: {e}")
-    finally:
+
+def ask_cameras():
+    """Камеры для команды: номер, список через запятую или all"""
+    while True:
+        value = input("Камеры (0, 0,1 или all): ").strip() or "0"
+        if value == "all":
+            return "all"
         try:
-            client_socket.close()
-        except:
-            pass
+            cameras = [int(cam) for cam in value.split(",")]
+        except ValueError:
+            print("Неверный выбор!")
+            continue
+        if any(cam < 0 for cam in cameras):
+            print("Неверный выбор!")
+            continue
+        return cameras[0] if len(cameras) == 1 else cameras
 
 if __name__ == "__main__":
     print("Клиент системы видеонаблюдения")
     
-    t1 = threading.Thread(target=video_receiver)
+    # Все окна рисует один поток; приемники только подключаются и добавляют окно
+    t1 = threading.Thread(target=display.run)
     t1.daemon = True
     t1.start()
 
-    time.sleep(2)
+    if VIDEO_MODE == "tiles":
+        tile_receiver()
+    else:
+        video_receiver()
 
     while True:
         print("\nМеню:")
         print("1. Установить таймаут")
         print("2. Установить чувствительность")
-        print("3. Включить детектор лиц (Cam0)")
-        print("4. Выключить детектор лиц (Cam0)")
-        print("5. Включить детектор движения (Cam0)")
-        print("6. Выключить детектор движения (Cam0)")
+        print("3. Включить детектор лиц")
+        print("4. Выключить детектор лиц")
+        print("5. Включить детектор движения")
+        print("6. Выключить детектор движения")
+        print("7. Открыть камеру в полном разрешении")
+        print("8. Настройки видеопотока")
+        print("9. Движок движения и детектор лиц для нескольких камер")
         print("q. Выйти")
         
         choice = input("➡ ").strip()
@@ -145,14 +470,53 @@ if __name__ == "__main__":
             val = input("Чувствительность: ")
             send_command({"action": "set_threshold", "value": val})
         elif choice == "3":
-            send_command({"action": "enable_face", "camera": 0})
+            send_command({"action": "enable_face", "camera": ask_cameras()})
         elif choice == "4":
-            send_command({"action": "disable_face", "camera": 0})
+            send_command({"action": "disable_face", "camera": ask_cameras()})
         elif choice == "5":
-            send_command({"action": "enable_motion", "camera": 0})
+            send_command({"action": "enable_motion", "camera": ask_cameras()})
         elif choice == "6":
-            send_command({"action": "disable_motion", "camera": 0})
+            send_command({"action": "disable_motion", "camera": ask_cameras()})
+        elif choice == "7":
+            try:
+                cam = int(input("Камера: "))
+                size = input("Разрешение WxH (Enter - исходное): ").strip()
+                size = tuple(map(int, size.lower().split("x"))) if size else None
+                if cam < 0 or (size is not None and (len(size) != 2 or min(size) <= 0)):
+                    raise ValueError(size)
+            except ValueError:
+                print("Неверный выбор!")
+                continue
+            camera_receiver(cam, size)  # окно добавляется в общий цикл отображения
+        elif choice == "8":
+            send_command({"action": "get_stream"})
+            latency = input("Целевая задержка, мс (Enter - без изменений): ").strip()
+            level = input("Ступень 0-5 (Enter - автоматически): ").strip()
+            cmd = {"action": "set_stream", "adaptive": not level}
+            try:
+                if latency:
+                    cmd["target_latency"] = int(latency) / 1000
+                    if cmd["target_latency"] <= 0:
+                        raise ValueError(latency)
+                if level:
+                    cmd["level"] = int(level)
+                    if not 0 <= cmd["level"] <= 5:
+                        raise ValueError(level)
+            except ValueError:
+                print("Неверный выбор!")
+                continue
+            send_command(cmd)
+        elif choice == "9":
+            cameras = ask_cameras()
+            engine = input("Движок (diff/average/mog2): ").strip() or "diff"
+            faces = input("Детектор лиц (y/n): ").strip().lower() == "y"
+            send_command({"action": "batch", "commands": [
+                {"action": "enable_motion", "camera": cameras},
+                {"action": "set_engine", "camera": cameras, "value": engine},
+                {"action": "enable_face" if faces else "disable_face", "camera": cameras},
+            ]})
         elif choice == "q":
             break
 
+    commands.close()
     print("Выход")
\ No newline at end of file
@@ -1,33 +1,363 @@
+import threading
+import time
 import cv2
 from camera_utils import draw_bounding_box
 
+class FaceDetectionStats:
+    """
+    Счетчики времени DNN: вызовы на одном кадре ('single') и пакетные
+    на нескольких кадрах ('batch') - для сравнения стоимости кадра
+    """
+
+    def __init__(self):
+        self.counters = {
+            'single': {'calls': 0, 'frames': 0, 'time': 0.0},
+            'batch': {'calls': 0, 'frames': 0, 'time': 0.0},
+        }
+
+    def record(self, frames, elapsed):
+        counter = self.counters['single' if frames == 1 else 'batch']
+        counter['calls'] += 1
+        counter['frames'] += frames
+        counter['time'] += elapsed
+
+    def summary(self):
+        """Среднее время на вызов и на кадр (мс) для каждого режима"""
+        result = {}
+        for kind, counter in self.counters.items():
+            calls, frames = counter['calls'], counter['frames']
+            result[kind] = {
+                'calls': calls,
+                'frames': frames,
+                'ms_per_call': counter['time'] * 1000 / calls if calls else 0.0,
+                'ms_per_frame': counter['time'] * 1000 / frames if frames else 0.0,
+            }
+        return result
+
+
+# Глобальные счетчики
+face_stats = FaceDetectionStats()
+
 def load_face_detection_model(face_proto, face_model):
     """Загрузка модели детектирования лиц"""
     net = cv2.dnn.readNet(face_model, face_proto)
     return net
 
-def detect_faces(net, frame, conf_threshold=0.7):
-    """Детектирование лиц на кадре"""
-    frame_opencv_dnn = frame.copy()
-    frame_height = frame_opencv_dnn.shape[0]
-    frame_width = frame_opencv_dnn.shape[1]
-
-    blob = cv2.dnn.blobFromImage(frame_opencv_dnn, 1.0, (300, 300), 
-                               [104, 117, 123], True, False)
-    net.setInput(blob)
-    detections = net.forward()
-    face_boxes = []
-
+def _parse_faces(detections, image_idx, frame_width, frame_height, conf_threshold):
+    """Разбор выхода сети для одного кадра пакета: [([x1, y1, x2, y2], confidence), ...]"""
+    faces = []
     for i in range(detections.shape[2]):
+        # Колонка 0 - номер кадра в пакете
+        if int(detections[0, 0, i, 0]) != image_idx:
+            continue
         confidence = detections[0, 0, i, 2]
         if confidence > conf_threshold:
             x1 = int(detections[0, 0, i, 3] * frame_width)
             y1 = int(detections[0, 0, i, 4] * frame_height)
             x2 = int(detections[0, 0, i, 5] * frame_width)
             y2 = int(detections[0, 0, i, 6] * frame_height)
-            w, h = x2 - x1, y2 - y1
-            face_boxes.append([x1, y1, x2, y2])
-            
-            draw_bounding_box(frame_opencv_dnn, (x1, y1, w, h), f"{confidence:.2f}", (0, 255, 0))
+            faces.append(([x1, y1, x2, y2], float(confidence)))
+    return faces
+
+def draw_faces(frame, faces):
+    """Отрисовка найденных лиц прямо на кадре"""
+    for (x1, y1, x2, y2), confidence in faces:
+        draw_bounding_box(frame, (x1, y1, x2 - x1, y2 - y1), f"{confidence:.2f}", (0, 255, 0))
+    return frame
+
+def detect_faces(net, frame, conf_threshold=0.7):
+    """Детектирование лиц на кадре"""
+    start = time.perf_counter()
+    blob = cv2.dnn.blobFromImage(frame, 1.0, (300, 300),
+                               [104, 117, 123], True, False)
+    net.setInput(blob)
+    detections = net.forward()
+    face_stats.record(1, time.perf_counter() - start)
+
+    faces = _parse_faces(detections, 0, frame.shape[1], frame.shape[0], conf_threshold)
+    return draw_faces(frame.copy(), faces), [box for box, _ in faces]
+
+def find_faces_batch(net, frames, conf_threshold=0.7):
+    """
+    Детектирование лиц сразу на нескольких кадрах одним проходом сети.
+    Проход на одном кадре считается в статистике как одиночный.
+    Возвращает список лиц [(box, confidence), ...] для каждого кадра
+    """
+    if not frames:
+        return []
+
+    start = time.perf_counter()
+    blob = cv2.dnn.blobFromImages(frames, 1.0, (300, 300),
+                                [104, 117, 123], True, False)
+    net.setInput(blob)
+    detections = net.forward()
+    face_stats.record(len(frames), time.perf_counter() - start)
+
+    return [_parse_faces(detections, i, frame.shape[1], frame.shape[0], conf_threshold)
+            for i, frame in enumerate(frames)]
+
+def motion_regions(contours, frame_size, padding=40):
+    """
+    Области для детектирования лиц вокруг контуров движения:
+    bounding box каждого контура расширяется на padding, пересекающиеся области сливаются.
+    Возвращает список (x, y, w, h)
+    """
+    frame_width, frame_height = frame_size
+    rects = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        rects.append([max(0, x - padding), max(0, y - padding),
+                      min(frame_width, x + w + padding), min(frame_height, y + h + padding)])
+
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for rect in rects:
+            for other in result:
+                if rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]:
+                    other[0], other[1] = min(other[0], rect[0]), min(other[1], rect[1])
+                    other[2], other[3] = max(other[2], rect[2]), max(other[3], rect[3])
+                    merged = True
+                    break
+            else:
+                result.append(rect)
+        rects = result
+
+    return [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in rects]
+
+
+class FaceDetectionWorker:
+    """
+    Фоновый поток детектирования лиц.
+    Для каждой камеры хранится только последний присланный кадр (старые заявки
+    вытесняются), все ожидающие кадры обрабатываются одним пакетом.
+    Если для кадра заданы области (regions), сеть видит только вырезки этих областей
+    Результаты публикуются вместе со временем кадра, по которому они получены
+    """
+
+    def __init__(self, net, conf_threshold=0.7):
+        self.net = net
+        self.conf_threshold = conf_threshold
+
+        self._cond = threading.Condition()
+        self._pending = {}   # {camera_idx: (frame, timestamp)}
+        self._results = {}   # {camera_idx: (faces, timestamp, frame)}
+        self._thread = None
+        self._running = False
+
+        self.submitted = 0
+        self.dropped_requests = 0
+        self.skipped_still = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="face-detection")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, camera_idx, frame, timestamp=None, regions=None):
+        """
+        Неблокирующая отправка кадра; необработанный прежний кадр камеры отбрасывается.
+        regions=None - весь кадр; пустой список - в кадре нет движения, сеть не запускается
+        """
+        with self._cond:
+            if regions is not None and not regions:
+                self.skipped_still += 1
+                return
+            if camera_idx in self._pending:
+                self.dropped_requests += 1
+            self._pending[camera_idx] = (frame, timestamp or time.time(), regions)
+            self.submitted += 1
+            self._cond.notify()
+
+    def get_result(self, camera_idx):
+        """Последний результат камеры: (faces, timestamp) или ([], None)"""
+        return self.get_detection(camera_idx)[:2]
+
+    def get_detection(self, camera_idx):
+        """Последний результат вместе с кадром, на котором он получен: (faces, timestamp, frame)"""
+        with self._cond:
+            return self._results.get(camera_idx, ([], None, None))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                batch, self._pending = self._pending, {}
+
+            # Каждая камера дает в пакет весь кадр или вырезки областей движения
+            images, owners = [], []
+            for cam_idx, (frame, _, regions) in batch.items():
+                for x, y, w, h in regions or [(0, 0, frame.shape[1], frame.shape[0])]:
+                    images.append(frame[y:y + h, x:x + w])
+                    owners.append((cam_idx, x, y))
+
+            try:
+                faces_list = find_faces_batch(self.net, images, self.conf_threshold)
+            except Exception as e:
+                print(f"\033[91m[FACES] Ошибка детектирования лиц: {e}\033[0m")
+                continue
+
+            results = {cam_idx: [] for cam_idx in batch}
+            for (cam_idx, x, y), faces in zip(owners, faces_list):
+                for (x1, y1, x2, y2), confidence in faces:
+                    results[cam_idx].append(([x1 + x, y1 + y, x2 + x, y2 + y], confidence))
+
+            with self._cond:
+                self.batches += 1
+                for cam_idx, faces in results.items():
+                    self._results[cam_idx] = (faces, batch[cam_idx][1], batch[cam_idx][0])
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'submitted': self.submitted,
+                'dropped_requests': self.dropped_requests,
+                'skipped_still': self.skipped_still,
+                'batches': self.batches,
+                'pending': len(self._pending),
+            }
+
+
+class FaceTracker:
+    """
+    Ведение лиц между запусками DNN для одной камеры.
+    Шаблон каждого лица берется с кадра детекции и ищется (cv2.matchTemplate)
+    в окрестности прежней рамки. Повторная детекция нужна каждые detect_every
+    кадров или сразу, когда совпадение шаблона падает ниже min_score
+    """
+
+    def __init__(self, detect_every=5, min_score=0.6, search_margin=24, request_timeout=1.0):
+        self.detect_every = detect_every
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.request_timeout = request_timeout
+
+        self.tracks = []  # [{'box': [x1, y1, x2, y2], 'confidence', 'template', 'score'}]
+        self.detection_timestamp = None
+        self.requested_at = None
+        self.frames_since_detection = 0
+        self.force_detection = True
+
+        # Метрики
+        self.detections = 0
+        self.tracked_frames = 0
+        self.low_score_redetects = 0
+        self.score_sum = 0.0
+        self.score_count = 0
+
+    def needs_detection(self, now=None):
+        """Пора ли запускать DNN (и не ждем ли уже результат прошлого запроса)"""
+        now = now or time.time()
+        if self.requested_at is not None and now - self.requested_at < self.request_timeout:
+            return False
+        return self.force_detection or self.frames_since_detection >= self.detect_every
+
+    def mark_requested(self, now=None):
+        self.requested_at = now or time.time()
+
+    def reset(self, frame, faces, timestamp):
+        """Новые рамки от DNN: шаблоны вырезаются из кадра, на котором шла детекция"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frame_height, frame_width = gray.shape
+        self.tracks = []
+        for (x1, y1, x2, y2), confidence in faces:
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(frame_width, x2), min(frame_height, y2)
+            if x2 - x1 < 8 or y2 - y1 < 8:
+                continue
+            self.tracks.append({
+                'box': [x1, y1, x2, y2],
+                'confidence': confidence,
+                'template': gray[y1:y2, x1:x2].copy(),
+                'score': 1.0,
+            })
+
+        self.detection_timestamp = timestamp
+        self.requested_at = None
+        self.frames_since_detection = 0
+        self.force_detection = False
+        self.detections += 1
+
+    def update(self, gray):
+        """Перенос рамок на новый кадр (в оттенках серого); возвращает [(box, confidence), ...]"""
+        self.frames_since_detection += 1
+        frame_height, frame_width = gray.shape
+        margin = self.search_margin
+        kept = []
+
+        for track in self.tracks:
+            x1, y1, x2, y2 = track['box']
+            template = track['template']
+            sx1, sy1 = max(0, x1 - margin), max(0, y1 - margin)
+            sx2, sy2 = min(frame_width, x2 + margin), min(frame_height, y2 + margin)
+            window = gray[sy1:sy2, sx1:sx2]
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                self.force_detection = True
+                continue
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            self.score_sum += score
+            self.score_count += 1
+            if score < self.min_score:
+                # Уверенность трекинга упала - нужна повторная детекция
+                self.low_score_redetects += 1
+                self.force_detection = True
+                continue
+
+            track['box'] = [sx1 + dx, sy1 + dy, sx1 + dx + template.shape[1], sy1 + dy + template.shape[0]]
+            track['score'] = score
+            kept.append(track)
+
+        self.tracks = kept
+        if kept:
+            self.tracked_frames += 1
+        return [(track['box'], track['confidence']) for track in kept]
+
+    def get_stats(self):
+        return {
+            'detect_every': self.detect_every,
+            'min_score': self.min_score,
+            'detections': self.detections,
+            'tracked_frames': self.tracked_frames,
+            'low_score_redetects': self.low_score_redetects,
+            'mean_score': self.score_sum / self.score_count if self.score_count else None,
+        }
+
+
+def update_faces(worker, camera_idx, frame, tracker=None, regions=None):
+    """
+    Один шаг детектирования лиц для камеры без ожидания DNN.
+    Без трекера кадр каждый раз уходит в worker и возвращается последний результат;
+    с трекером DNN запускается по его политике, а между детекциями рамки ведутся шаблонами.
+    Возвращает (faces, timestamp кадра последней детекции)
+    """
+    if tracker is None:
+        worker.submit(camera_idx, frame, regions=regions)
+        return worker.get_result(camera_idx)
+
+    faces, timestamp, detection_frame = worker.get_detection(camera_idx)
+    if timestamp is not None and timestamp != tracker.detection_timestamp:
+        tracker.reset(detection_frame, faces, timestamp)
 
-    return frame_opencv_dnn, face_boxes
+    faces = tracker.update(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    if tracker.needs_detection():
+        worker.submit(camera_idx, frame, regions=regions)
+        tracker.mark_requested()
+    return faces, tracker.detection_timestamp
@@ -1,25 +1,472 @@
+import atexit
 import datetime
+import gzip
 import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
 import cv2
 from collections import defaultdict
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# motion_log_YYYY-MM-DD.txt, в архиве - с суффиксом .gz или .zst
+LOG_FILE_RE = re.compile(r"^motion_log_(\d{4}-\d{2}-\d{2})\.txt(\.gz|\.zst)?$")
+
+
+def archive_path(path):
+    """
+    Архив дневного лога: уже существующий архив этого дня (если его можно дописать),
+    иначе .zst при установленном zstandard, иначе .gz
+    """
+    if zstandard is not None and os.path.exists(path + ".zst"):
+        return path + ".zst"
+    if os.path.exists(path + ".gz"):
+        return path + ".gz"
+    return path + (".zst" if zstandard is not None else ".gz")
+
+
+def compress_log(path, target):
+    """
+    Сжатие закрытого дневного лога в архив target. Существующий архив копируется,
+    а записи path дописываются к нему отдельным gzip-членом / кадром zstd -
+    прежнее содержимое архива сохраняется. Результат пишется во временный файл,
+    возвращает (временный файл, сколько байт path сжато)
+    """
+    temp = target + ".tmp"
+    with open(path, 'rb') as src, open(temp, 'wb') as dst:
+        if os.path.exists(target):
+            with open(target, 'rb') as archive:
+                shutil.copyfileobj(archive, dst, 1024 * 1024)
+        if target.endswith(".zst"):
+            zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+        else:
+            with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6) as gz:
+                shutil.copyfileobj(src, gz, 1024 * 1024)
+        return temp, src.tell()
+
+
+class EventStore:
+    """
+    Структурированные события в SQLite (режим WAL): время, камера, тип события,
+    объект, рамка и длительность - в отдельных колонках с индексами по времени
+    и по (камера, время). Запись идет только из потока LogWriter пачками
+    в одной транзакции; query() открывает отдельное соединение только для чтения.
+    Новая база создается в режиме auto_vacuum=INCREMENTAL: после prune() освободившиеся
+    страницы возвращаются файловой системе понемногу, без полного VACUUM. В базе,
+    созданной без этого режима, освободившиеся страницы только переиспользуются
+    """
+
+    COLUMNS = ("ts", "camera", "event", "object_id", "x", "y", "w", "h",
+               "duration", "objects", "message")
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'events'").fetchone() is None:
+            # Режим задается только новой базе, до создания таблиц: перевод старой базы
+            # потребовал бы полного VACUUM, а он надолго остановил бы поток записи
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, camera INTEGER, event TEXT NOT NULL, "
+            "object_id TEXT, x INTEGER, y INTEGER, w INTEGER, h INTEGER, "
+            "duration REAL, objects INTEGER, message TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS events_ts ON events (ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS events_camera_ts ON events (camera, ts)")
+        conn.commit()
+        return conn
+
+    def insert(self, rows):
+        """Вставка пачки строк (кортежи в порядке COLUMNS) одной транзакцией"""
+        if self._conn is None:
+            self._conn = self._connect()
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO events ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                rows,
+            )
+
+    def prune(self, before, vacuum_pages=None):
+        """
+        Удаление событий старше before (unix-время) и возврат свободных страниц
+        (не больше vacuum_pages, None - все). Возвращает число удаленных строк
+        """
+        if self._conn is None:
+            self._conn = self._connect()
+        with self._conn:
+            deleted = self._conn.execute("DELETE FROM events WHERE ts < ?", (before,)).rowcount
+        pages = "" if vacuum_pages is None else f"({int(vacuum_pages)})"
+        # executescript шагает до конца: execute() освободил бы только одну страницу
+        self._conn.executescript(f"PRAGMA incremental_vacuum{pages};")
+        return deleted
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def query(self, start=None, end=None, camera=None, event=None, limit=1000):
+        """
+        Выборка событий по интервалу времени (unix-время), камере и типу события,
+        по возрастанию времени. Возвращает список словарей
+        """
+        if not os.path.exists(self.path):
+            return []
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("ts < ?")
+            params.append(end)
+        if camera is not None:
+            conditions.append("camera = ?")
+            params.append(camera)
+        if event is not None:
+            conditions.append("event = ?")
+            params.append(event)
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM events"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            return [dict(zip(self.COLUMNS, row)) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+
+class LogWriter:
+    """
+    Фоновая запись лога. Записи кладутся в ограниченную очередь, поток записи
+    держит открытым один файл (новый файл - новый день) и сбрасывает записи
+    пачками: по объему flush_size или раз в flush_interval секунд.
+    Вместе с текстом пачкой пишутся и события в EventStore (если он задан).
+    Вызывающий поток никогда не ждет диска; при переполнении очереди
+    записи отбрасываются и считаются в dropped.
+    flush() только сбрасывает очередь на диск, поток продолжает работать;
+    close() останавливает его окончательно (вызывается через atexit).
+    call() выполняет функцию в потоке записи - так обслуживается EventStore
+    без второго пишущего соединения и подменяются сжатые логи
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_queue=10000, flush_size=64 * 1024, flush_interval=1.0, event_store=None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.event_store = event_store
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._path = None
+        self.on_rotate = None  # вызывается в потоке записи после закрытия файла прошлого дня
+        self.closed = False
+
+        # Счетчики
+        self.written = 0
+        self.events = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dropped_after_close = 0
+
+        self._thread = threading.Thread(target=self._run, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, path, entry, event=None):
+        """
+        Постановка записи в очередь, без ожидания.
+        path=None - без текстового лога; event - строка для EventStore или None.
+        После close() запись не принимается: считается в dropped, о первой выводится ошибка
+        """
+        if self.closed:
+            if not self.dropped_after_close:
+                print(f"\033[91m[ERROR] Запись в закрытый лог: {entry.rstrip()}\033[0m")
+            self.dropped_after_close += 1
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait((path, entry, event))
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self, path):
+        previous = self._path if self._file is not None else None
+        if self._file is not None:
+            self._file.close()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._path = path
+        if previous is not None and previous != path and self.on_rotate is not None:
+            self.on_rotate(previous)
+
+    def _flush(self, pending):
+        """Запись пачки: pending - список (путь, запись, событие) в порядке поступления"""
+        lines = [(path, entry) for path, entry, _ in pending if path is not None]
+        start = 0
+        while start < len(lines):
+            path = lines[start][0]
+            end = start
+            while end < len(lines) and lines[end][0] == path:
+                end += 1
+            try:
+                if path != self._path:
+                    self._open(path)
+                self._file.write("".join(entry for _, entry in lines[start:end]))
+                self._file.flush()
+                self.written += end - start
+            except Exception as e:
+                self.errors += 1
+                self._path = None
+                print(f"\033[91m[ERROR] Ошибка записи лога: {e}\033[0m")
+            start = end
+
+        rows = [event for _, _, event in pending if event is not None]
+        if rows and self.event_store is not None:
+            try:
+                self.event_store.insert(rows)
+                self.events += len(rows)
+            except Exception as e:
+                self.errors += 1
+                print(f"\033[91m[ERROR] Ошибка записи событий: {e}\033[0m")
+        self.flushes += 1
+        pending.clear()
+
+    def _run(self):
+        pending = []
+        pending_size = 0
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic()) if pending else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                break
+            if callable(item):
+                # Запрос call()/flush(): сначала пишем накопленное, потом выполняем
+                if pending:
+                    self._flush(pending)
+                    pending_size = 0
+                    last_flush = time.monotonic()
+                self._call(item)
+                continue
+            if item is not None:
+                pending.append(item)
+                pending_size += len(item[1]) if item[0] is not None else 64
+
+            if pending and (pending_size >= self.flush_size
+                            or time.monotonic() - last_flush >= self.flush_interval):
+                self._flush(pending)
+                pending_size = 0
+                last_flush = time.monotonic()
+
+        # Остановка: дописываем все, что успело попасть в очередь
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if callable(item):
+                if pending:
+                    self._flush(pending)
+                self._call(item)
+            elif item is not self._STOP:
+                pending.append(item)
+        if pending:
+            self._flush(pending)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.event_store is not None:
+            self.event_store.close()
+
+    def release(self, path):
+        """Только в потоке записи (через call): закрывает path, если он открыт; следующая запись откроет его заново"""
+        if self._file is not None and self._path == path:
+            self._file.close()
+            self._file = None
+            self._path = None
+
+    def _call(self, func):
+        try:
+            func()
+        except Exception as e:
+            self.errors += 1
+            print(f"\033[91m[ERROR] Ошибка обслуживания лога: {e}\033[0m")
+
+    def call(self, func, timeout=2.0):
+        """Выполнение func() в потоке записи после всего, что уже в очереди (без ожидания)"""
+        if self.closed or not self._thread.is_alive():
+            return False
+        try:
+            self._queue.put(func, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self, timeout=2.0):
+        """Ожидание записи всего, что уже в очереди; поток записи продолжает работать"""
+        done = threading.Event()
+        return self.call(done.set, timeout) and done.wait(timeout)
+
+    def close(self, timeout=2.0):
+        """Сброс очереди на диск и окончательная остановка потока записи"""
+        self.closed = True
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'events': self.events,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'errors': self.errors,
+        }
+
+
+class MotionRollup:
+    """Накопленная за окно сводка по одной камере (вместо строки [SUMMARY] на каждый кадр)"""
+
+    def __init__(self, start):
+        self.start = start
+        self.frames = 0
+        self.motion_frames = 0
+        self.active_min = None
+        self.active_max = 0
+        self.active_sum = 0
+        self.new_objects = 0
+        self.lost_objects = 0
+        self.total_objects = 0
+        self.object_lines = 0  # новых объектов записано отдельными строками [OBJECT]
+        self.folded_objects = 0  # остальные - только в сводке, с общей рамкой
+        self.folded_box = None
+
+    def fold_object(self, position, size):
+        """Новый объект сверх лимита строк окна: в тексте учитывается только в общей рамке сводки"""
+        x, y = position
+        w, h = size
+        self.folded_objects += 1
+        if self.folded_box is None:
+            self.folded_box = (x, y, x + w, y + h)
+        else:
+            x1, y1, x2, y2 = self.folded_box
+            self.folded_box = (min(x1, x), min(y1, y), max(x2, x + w), max(y2, y + h))
+
+    def folded_rect(self):
+        """Общая рамка свернутых объектов (x, y, w, h) или None"""
+        if self.folded_box is None:
+            return None
+        x1, y1, x2, y2 = self.folded_box
+        return x1, y1, x2 - x1, y2 - y1
+
+    def add(self, objects_info):
+        """Кадр с движением"""
+        active = objects_info['active_objects']
+        self.frames += 1
+        self.motion_frames += 1
+        self.active_min = active if self.active_min is None else min(self.active_min, active)
+        self.active_max = max(self.active_max, active)
+        self.active_sum += active
+        self.new_objects += len(objects_info['new_objects'])
+        self.lost_objects += len(objects_info['lost_objects'])
+        self.total_objects = objects_info['total_objects']
+
+    def add_idle(self):
+        """Кадр активного режима, на котором движения не было"""
+        self.frames += 1
+
+    def format(self, camera_idx, now):
+        mean = self.active_sum / self.motion_frames if self.motion_frames else 0.0
+        text = (f"Cam{camera_idx}: За {now - self.start:.1f}s кадров: {self.frames}, "
+                f"с движением: {self.motion_frames / self.frames:.0%}, "
+                f"Активных мин/сред/макс: {self.active_min or 0}/{mean:.1f}/{self.active_max}, "
+                f"Новых: {self.new_objects}, Потерянных: {self.lost_objects}, "
+                f"Всего объектов: {self.total_objects}")
+        if self.folded_objects:
+            x, y, w, h = self.folded_rect()
+            text += f", Из них без отдельной строки: {self.folded_objects} (область: ({x}, {y}), {w}x{h})"
+        return text
+
 
 class MotionLogger:
-    def __init__(self):
+    def __init__(self, rollup_interval=10.0, text_log=True, event_db="events.db", days_to_keep=90,
+                 object_lines=None):
+        """
+        object_lines - если задано, сколько новых объектов на камеру за окно сводки
+        пишется отдельными строками [OBJECT], остальные сворачиваются в [SUMMARY]
+        (в базу событий попадают все); None - строка на каждый новый объект;
+        text_log - писать текстовый motion_log_YYYY-MM-DD.txt;
+        event_db - файл SQLite с событиями в каталоге логов (None - без базы);
+        days_to_keep - сколько дней хранить (сжатые) логи
+        """
         self.logs_dir = "logs"
+        self.rollup_interval = rollup_interval
+        self.object_lines = object_lines
+        self.text_log = text_log
+        self.days_to_keep = days_to_keep
+        self._archive_lock = threading.Lock()
+        # Лог пишут и фоновые потоки (архивация, поток записи): файл дня,
+        # счетчик и кэш отметки времени меняются только под этой блокировкой
+        self._log_lock = threading.Lock()
+        self._rollups = {}  # {camera_idx: MotionRollup}
         self.current_log_file = None
         self.object_counter = defaultdict(int)
         self.object_tracker = defaultdict(set)
         self.log_entry_count = 0
+        self._ts_second = None
+        self._ts_text = None
 
         os.makedirs(self.logs_dir, exist_ok=True)
-        self._update_log_file()
+        self.events = EventStore(os.path.join(self.logs_dir, event_db)) if event_db else None
+        self.writer = LogWriter(event_store=self.events)
+        # Файл прошлого дня закрыт - его можно сжимать
+        self.writer.on_rotate = lambda path: self.archive_logs_async()
+        with self._log_lock:
+            self._update_log_file()
+        atexit.register(self.close)
 
     # ================== ВСПОМОГАТЕЛЬНЫЕ ==================
 
-    def _update_log_file(self):
+    def _timestamp(self):
+        """Отметка времени; строка форматируется заново только раз в секунду"""
+        second = int(time.time())
+        if second != self._ts_second:
+            self._ts_second = second
+            self._ts_text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return self._ts_text
+
+    def _update_log_file(self, today=None):
         """Создает новый лог-файл на каждый день"""
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        if today is None:
+            today = self._timestamp()[:10]
         new_log_file = os.path.join(self.logs_dir, f"motion_log_{today}.txt")
 
         if new_log_file != self.current_log_file:
@@ -27,21 +474,31 @@ class MotionLogger:
             self.log_entry_count = 0
             self._print("[SYSTEM]", f"Новый файл лога: {self.current_log_file}", "system")
 
-    def _make_log(self, tag, message):
-        """Формирует запись в лог"""
-        self._update_log_file()
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        entry = f"[{timestamp}] {tag} {message}\n"
-        return entry, timestamp
-
-    def _write_log(self, entry):
-        """Записывает в файл"""
-        try:
-            with open(self.current_log_file, 'a', encoding='utf-8') as f:
-                f.write(entry)
+    def _write_log(self, tag, message, event=None, text=True):
+        """
+        Формирует запись и ставит ее (и событие для базы) в очередь фоновой записи -
+        диск не блокирует обработку. text=False - только событие для базы, без строки
+        в текстовом логе. Можно вызывать из любого потока; возвращает отметку времени
+        """
+        if self.events is None:
+            event = None
+        text = text and self.text_log
+        with self._log_lock:
+            timestamp = self._timestamp()
+            if not self.current_log_file.endswith(f"{timestamp[:10]}.txt"):
+                self._update_log_file(timestamp[:10])
+            if not text and event is None:
+                return timestamp
+            entry = f"[{timestamp}] {tag} {message}\n"
+            self.writer.write(self.current_log_file if text else None, entry, event)
             self.log_entry_count += 1
-        except Exception as e:
-            self._print("[ERROR]", f"Ошибка записи лога: {e}", "error")
+        return timestamp
+
+    @staticmethod
+    def _event(event, message, camera=None, object_id=None, box=None, duration=None, objects=None):
+        """Строка для EventStore в порядке EventStore.COLUMNS"""
+        x, y, w, h = box if box is not None else (None, None, None, None)
+        return (time.time(), camera, event, object_id, x, y, w, h, duration, objects, message)
 
     def _print(self, tag, message, log_type="reset"):
         """Цветной вывод в терминал"""
@@ -60,59 +517,106 @@ class MotionLogger:
     # ================== ПУБЛИЧНЫЕ МЕТОДЫ ==================
 
     def log_system_event(self, message):
-        entry, ts = self._make_log("[SYSTEM]", message)
-        self._write_log(entry)
+        ts = self._write_log("[SYSTEM]", message, self._event("system", message))
         self._print("[SYSTEM]", f"{ts}: {message}", "system")
 
     def log_camera_status(self, camera_idx, status):
-        entry, ts = self._make_log(f"[CAM{camera_idx}]", status)
-        self._write_log(entry)
+        ts = self._write_log(f"[CAM{camera_idx}]", status, self._event("camera", status, camera_idx))
         self._print(f"[CAM{camera_idx}]", f"{ts}: {status}", "camera")
 
     def log_motion_detected(self, camera_idx, is_triggered=False):
         if is_triggered:
             msg = f"Cam{camera_idx}: Камера включена по движению"
-            entry, _ = self._make_log("[TRIGGER]", msg)
+            tag = "[TRIGGER]"
+            event = self._event("trigger", msg, camera_idx)
             self._print("[TRIGGER]", msg, "trigger")
         else:
             count = self.object_counter[camera_idx]
             msg = f"Cam{camera_idx}: Движение обнаружено (объектов: {count})"
-            entry, _ = self._make_log("[MOTION]", msg)
+            tag = "[MOTION]"
+            event = self._event("motion", msg, camera_idx, objects=count)
             self._print("[MOTION]", msg, "motion")
-        self._write_log(entry)
+        self._write_log(tag, msg, event)
 
     def log_motion_stopped(self, camera_idx, duration, total_objects):
+        self.flush_rollup(camera_idx)
         msg = f"Cam{camera_idx}: Движение завершено (длительность: {duration:.1f}s, объектов: {total_objects})"
-        entry, _ = self._make_log("[MOTION]", msg)
-        self._write_log(entry)
+        self._write_log("[MOTION]", msg, self._event("motion_stopped", msg, camera_idx,
+                                                     duration=duration, objects=total_objects))
         self._print("[MOTION]", msg, "motion")
 
+    def _rollup(self, camera_idx, now):
+        rollup = self._rollups.get(camera_idx)
+        if rollup is None:
+            rollup = self._rollups[camera_idx] = MotionRollup(now)
+        return rollup
+
     def log_new_objects(self, camera_idx, objects_info):
+        """
+        Новые объекты - каждый отдельной строкой [OBJECT] и событием в базе.
+        Если задан object_lines, в текстовый лог за окно сводки идут только первые
+        object_lines, остальные только считаются в окне и попадают в строку [SUMMARY]
+        """
+        rollup = self._rollup(camera_idx, time.time())
         for obj_id, obj_info in objects_info['new_objects'].items():
             msg = (f"Cam{camera_idx}: Новый объект #{obj_id} "
                    f"(позиция: {obj_info['position']}, размер: {obj_info['size'][0]}x{obj_info['size'][1]})")
-            entry, _ = self._make_log("[OBJECT]", msg)
-            self._write_log(entry)
+            event = self._event("object", msg, camera_idx, obj_id,
+                                (*obj_info['position'], *obj_info['size']))
+            if self.object_lines is not None and rollup.object_lines >= self.object_lines:
+                rollup.fold_object(obj_info['position'], obj_info['size'])
+                self._write_log("[OBJECT]", msg, event, text=False)
+                continue
+            rollup.object_lines += 1
+            self._write_log("[OBJECT]", msg, event)
             self._print("[OBJECT]", f"Cam{camera_idx}: Новый объект {obj_id}", "object")
 
     def log_motion_summary(self, camera_idx, objects_info):
-        msg = (f"Cam{camera_idx}: Всего объектов: {objects_info['total_objects']}, "
-               f"Активных: {objects_info['active_objects']}, "
-               f"Новых: {len(objects_info['new_objects'])}, "
-               f"Потерянных: {len(objects_info['lost_objects'])}")
-        entry, _ = self._make_log("[SUMMARY]", msg)
-        self._write_log(entry)
+        """
+        Сводка кадра с движением. Копится в памяти и пишется одной строкой
+        раз в rollup_interval секунд (и при завершении движения)
+        """
+        now = time.time()
+        rollup = self._rollup(camera_idx, now)
+        rollup.add(objects_info)
+        self._advance_rollup(camera_idx, rollup, now)
+
+    def log_motion_idle(self, camera_idx):
+        """Кадр активного режима без движения - нужен для доли кадров с движением"""
+        now = time.time()
+        rollup = self._rollup(camera_idx, now)
+        rollup.add_idle()
+        self._advance_rollup(camera_idx, rollup, now)
+
+    def _advance_rollup(self, camera_idx, rollup, now):
+        """
+        Окно закончилось - сводка пишется, следующее окно начинается с того же момента,
+        так что окна идут без разрывов. Закрывают сводку камеры только
+        log_motion_stopped и reset_camera_objects
+        """
+        if now - rollup.start >= self.rollup_interval:
+            self.flush_rollup(camera_idx, now)
+            self._rollups[camera_idx] = MotionRollup(now)
+
+    def flush_rollup(self, camera_idx, now=None):
+        """Запись накопленной сводки камеры (если она есть)"""
+        rollup = self._rollups.pop(camera_idx, None)
+        if rollup is None or not rollup.frames:
+            return
+        now = now or time.time()
+        msg = rollup.format(camera_idx, now)
+        self._write_log("[SUMMARY]", msg, self._event("summary", msg, camera_idx, box=rollup.folded_rect(),
+                                                      duration=now - rollup.start, objects=rollup.new_objects))
         # Сводка выводится только в файл
 
     def log_settings(self, settings):
         settings_str = ", ".join(f"{k}: {v}" for k, v in settings.items())
-        entry, _ = self._make_log("[SETTINGS]", f"Настройки системы: {settings_str}")
-        self._write_log(entry)
+        msg = f"Настройки системы: {settings_str}"
+        self._write_log("[SETTINGS]", msg, self._event("settings", msg))
         self._print("[SETTINGS]", "Настройки системы сохранены", "settings")
 
     def log_error(self, message):
-        entry, ts = self._make_log("[ERROR]", message)
-        self._write_log(entry)
+        ts = self._write_log("[ERROR]", message, self._event("error", message))
         self._print("[ERROR]", f"{ts}: {message}", "error")
 
     # ================== ТРЕКИНГ ОБЪЕКТОВ ==================
@@ -149,24 +653,117 @@ class MotionLogger:
         return objects_info
 
     def reset_camera_objects(self, camera_idx):
+        self.flush_rollup(camera_idx)
         self.object_counter[camera_idx] = 0
         self.object_tracker[camera_idx] = set()
 
     # ================== УПРАВЛЕНИЕ ЛОГАМИ ==================
 
-    def cleanup_old_logs(self, days_to_keep=30):
-        """Удаляет логи старше N дней"""
+    def flush(self):
+        """
+        Дописывает сводки и очередь на диск, запись продолжает работать -
+        вызывается при остановке мониторинга, который можно запустить снова
+        """
+        for camera_idx in list(self._rollups):
+            self.flush_rollup(camera_idx)
+        self.writer.flush()
+
+    def close(self):
+        """Окончательное закрытие лога при выходе из программы (через atexit)"""
+        if self.writer.closed:
+            return
+        for camera_idx in list(self._rollups):
+            self.flush_rollup(camera_idx)
+        self.writer.close()
+        stats = self.writer.get_stats()
+        if stats['dropped'] or stats['errors']:
+            self._print("[SYSTEM]", f"Лог: потеряно записей {stats['dropped']}, "
+                                    f"ошибок записи {stats['errors']}", "error")
+
+    def cleanup_old_logs(self, days_to_keep=None, compress=True):
+        """
+        Архивация логов: закрытые дневные файлы (прошлые дни) сжимаются,
+        файлы старше days_to_keep дней удаляются. Возраст берется из даты в имени файла.
+        Из базы событий удаляются события того же возраста (в потоке записи)
+        """
+        if days_to_keep is None:
+            days_to_keep = self.days_to_keep
+        if not self._archive_lock.acquire(blocking=False):
+            return  # архивация уже идет
         try:
-            current_time = datetime.datetime.now()
-            for filename in os.listdir(self.logs_dir):
-                if filename.startswith("motion_log_") and filename.endswith(".txt"):
-                    file_path = os.path.join(self.logs_dir, filename)
-                    file_time = datetime.datetime.fromtimestamp(os.path.getctime(file_path))
-                    if (current_time - file_time).days > days_to_keep:
+            today = datetime.date.today()
+            with self._log_lock:
+                current_log_file = self.current_log_file
+            flushed = False
+            for filename in sorted(os.listdir(self.logs_dir)):
+                match = LOG_FILE_RE.match(filename)
+                if match is None:
+                    continue
+                file_path = os.path.join(self.logs_dir, filename)
+                try:
+                    age = (today - datetime.date.fromisoformat(match.group(1))).days
+                    if age > days_to_keep:
                         os.remove(file_path)
                         self.log_system_event(f"Удален старый лог-файл: {filename}")
+                    elif compress and match.group(2) is None and age >= 1 \
+                            and file_path != current_log_file:
+                        if not flushed:
+                            # Записи прошлого дня, еще стоящие в очереди, попадают в файл до сжатия
+                            self.writer.flush()
+                            flushed = True
+                        self._archive_log(file_path)
+                except Exception as e:
+                    self.log_error(f"Ошибка при архивации лога {filename}: {e}")
+            if self.events is not None:
+                cutoff = datetime.datetime.combine(today - datetime.timedelta(days=days_to_keep),
+                                                   datetime.time()).timestamp()
+                self.writer.call(lambda: self._prune_events(cutoff))
         except Exception as e:
             self.log_error(f"Ошибка при очистке старых логов: {e}")
+        finally:
+            self._archive_lock.release()
+
+    def _archive_log(self, file_path, timeout=30.0):
+        """
+        Сжатие закрытого файла прошлого дня. Сжимается в фоновом потоке, а архив
+        подменяется в потоке записи: там файл закрывается, если его снова открыли
+        поздние записи, и архив принимается, только если файл с начала сжатия
+        не дописывался. Иначе сжатие повторится при следующей архивации
+        """
+        filename = os.path.basename(file_path)
+        target = archive_path(file_path)
+        temp, size = compress_log(file_path, target)
+        done = threading.Event()
+
+        def commit():
+            try:
+                self.writer.release(file_path)
+                if os.path.getsize(file_path) != size:
+                    os.remove(temp)
+                    return
+                os.replace(temp, target)
+                os.remove(file_path)
+                self.log_system_event(f"Лог-файл {filename} сжат: {size // 1024} КБ -> "
+                                      f"{os.path.basename(target)}, {os.path.getsize(target) // 1024} КБ")
+            finally:
+                done.set()
+
+        if not self.writer.call(commit):
+            os.remove(temp)
+            return
+        done.wait(timeout)
+
+    def _prune_events(self, cutoff):
+        """Выполняется в потоке записи: события старше cutoff удаляются из базы"""
+        deleted = self.events.prune(cutoff)
+        if deleted:
+            self.log_system_event(f"Из базы событий удалено старых записей: {deleted}")
+
+    def archive_logs_async(self):
+        """cleanup_old_logs в фоновом потоке (сжатие не задерживает запись и обработку)"""
+        thread = threading.Thread(target=self.cleanup_old_logs, name="log-archive")
+        thread.daemon = True
+        thread.start()
 
 
 # Глобальный экземпляр
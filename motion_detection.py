@@ -1,7 +1,262 @@
 import cv2
 import numpy as np
 import datetime
-from camera_utils import overlay_mask, get_no_signal_frame, draw_bounding_box
+from camera_utils import CompiledMask, overlay_mask, get_no_signal_frame, draw_bounding_box
+
+def _odd(value):
+    """Ближайший нечетный размер ядра, не меньше 3"""
+    value = max(3, int(round(value)))
+    return value if value % 2 else value + 1
+
+
+class MotionDetector:
+    """
+    Детектор движения для одной камеры (движок "diff" - разница двух кадров).
+    Хранит размытый серый кадр (с уже наложенной маской) от предыдущего вызова,
+    поэтому каждый новый кадр проходит предобработку только один раз.
+
+    detection_size (например (320, 240)) - разрешение, на котором идет детекция;
+    контуры возвращаются в координатах исходного кадра.
+    С CompiledMask кадр обрезается до ROI незамаскированной области
+    """
+
+    engine = "diff"
+
+    def __init__(self, mask=None, detection_size=None, blur_size=(21, 21)):
+        self.detection_size = detection_size
+        self.base_blur_size = blur_size
+        self.prev_blur = None
+        self.set_mask(mask)
+
+    def set_mask(self, mask):
+        """Смена маски: маска подгоняется под разрешение детекции при первом кадре"""
+        self.mask = mask
+        self.frame_size = None
+        # Накопленное состояние посчитано со старой маской
+        self.reset()
+
+    def reset(self):
+        """Сброс опорного кадра"""
+        self.prev_blur = None
+
+    def _configure(self, frame_size):
+        """Параметры пайплайна под размер входного кадра (считаются один раз)"""
+        self.frame_size = frame_size
+        self.roi = None
+        mask = self.mask
+        region_size = frame_size
+
+        if isinstance(mask, CompiledMask):
+            layout = mask.for_size(frame_size)
+            mask = layout['mask']
+            x, y, w, h = layout['roi']
+            if (w, h) != frame_size:
+                # Замаскированные края кадра не обрабатываются вовсе
+                self.roi = (x, y, w, h)
+                mask = mask[y:y + h, x:x + w]
+                region_size = (w, h)
+
+        self.empty_roi = region_size[0] == 0 or region_size[1] == 0
+        if self.empty_roi:
+            return
+
+        if self.detection_size is None:
+            work_size = region_size
+        else:
+            work_size = (max(1, round(region_size[0] * self.detection_size[0] / frame_size[0])),
+                         max(1, round(region_size[1] * self.detection_size[1] / frame_size[1])))
+        self.work_size = work_size
+
+        # Масштаб и сдвиг возврата контуров в координаты кадра
+        scale_x = region_size[0] / work_size[0]
+        scale_y = region_size[1] / work_size[1]
+        self.scale = None if work_size == region_size else np.array([scale_x, scale_y])
+        self.offset = None if self.roi is None else np.array(self.roi[:2], dtype=np.int32)
+        self.area_scale = scale_x * scale_y
+
+        # Ядра уменьшаются вместе с кадром
+        factor = work_size[0] / region_size[0]
+        self.blur_size = (_odd(self.base_blur_size[0] * factor), _odd(self.base_blur_size[1] * factor))
+        self.kernel = np.ones((_odd(5 * factor), _odd(5 * factor)), np.uint8)
+        self.dilate_iterations = max(1, int(round(2 * factor)))
+
+        self.inverted_mask = None
+        if mask is not None:
+            if (mask.shape[1], mask.shape[0]) != work_size:
+                mask = cv2.resize(mask, work_size, interpolation=cv2.INTER_NEAREST)
+            self.inverted_mask = cv2.bitwise_not(mask)
+        self.reset()
+
+    def _preprocess(self, frame):
+        """Обрезка по ROI + уменьшение + оттенки серого + размытие + маска"""
+        frame_size = (frame.shape[1], frame.shape[0])
+        if frame_size != self.frame_size:
+            self._configure(frame_size)
+        if self.empty_roi:
+            # Маска закрывает весь кадр
+            return None
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            frame = frame[y:y + h, x:x + w]
+        if self.scale is not None:
+            frame = cv2.resize(frame, self.work_size, interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        blur = cv2.GaussianBlur(gray, self.blur_size, 0)
+        if self.inverted_mask is not None:
+            blur = cv2.bitwise_and(blur, blur, mask=self.inverted_mask)
+        return blur
+
+    def _cleanup(self, thresh):
+        """Морфологические операции для улучшения детектирования"""
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, self.kernel)
+        return cv2.dilate(thresh, None, iterations=self.dilate_iterations)
+
+    def _foreground(self, current_blur, threshold):
+        """
+        Бинарная маска движущихся пикселей.
+        None - кадр ушел только на обновление модели
+        """
+        if self.prev_blur is None:
+            self.prev_blur = current_blur
+            return None
+
+        frame_delta = cv2.absdiff(self.prev_blur, current_blur)
+        self.prev_blur = current_blur
+        return cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_BINARY)[1]
+
+    def _find_contours(self, thresh, min_area):
+        """Поиск значимых контуров и перевод их в координаты кадра"""
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        work_min_area = min_area / self.area_scale
+        significant_contours = [c for c in contours if cv2.contourArea(c) > work_min_area]
+        if self.scale is not None:
+            significant_contours = [(c * self.scale).astype(np.int32) for c in significant_contours]
+        if self.offset is not None:
+            significant_contours = [c + self.offset for c in significant_contours]
+        return bool(significant_contours), significant_contours
+
+    def detect(self, frame, threshold=25, min_area=500):
+        """
+        Детектирование движения на новом кадре.
+        Первый кадр после создания или сброса только запоминается
+        """
+        if frame is None:
+            return False, []
+
+        current_blur = self._preprocess(frame)
+        if current_blur is None:
+            return False, []
+        thresh = self._foreground(current_blur, threshold)
+        if thresh is None:
+            return False, []
+        return self._find_contours(self._cleanup(thresh), min_area)
+
+    def has_motion(self, frame, threshold=25, min_area=500):
+        """
+        Быстрая проверка для режима ожидания: только да/нет, без контуров.
+        Пустая разница отсекается подсчетом пикселей до морфологии,
+        площадь областей считается через connectedComponentsWithStats
+        """
+        if frame is None:
+            return False
+
+        current_blur = self._preprocess(frame)
+        if current_blur is None:
+            return False
+        thresh = self._foreground(current_blur, threshold)
+        if thresh is None or not cv2.countNonZero(thresh):
+            return False
+
+        thresh = self._cleanup(thresh)
+        work_min_area = min_area / self.area_scale
+        if cv2.countNonZero(thresh) <= work_min_area:
+            return False
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        return bool((stats[1:, cv2.CC_STAT_AREA] > work_min_area).any())
+
+
+class RunningAverageDetector(MotionDetector):
+    """
+    Движок "average": кадр сравнивается с фоном,
+    который накапливается скользящим средним (cv2.accumulateWeighted)
+    """
+
+    engine = "average"
+
+    def __init__(self, mask=None, detection_size=None, blur_size=(21, 21), alpha=0.05):
+        self.alpha = alpha
+        self.background = None
+        super().__init__(mask, detection_size, blur_size)
+
+    def reset(self):
+        super().reset()
+        self.background = None
+
+    def _foreground(self, current_blur, threshold):
+        if self.background is None:
+            self.background = current_blur.astype(np.float32)
+            return None
+
+        frame_delta = cv2.absdiff(current_blur, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(current_blur, self.background, self.alpha)
+        return cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_BINARY)[1]
+
+
+class BackgroundSubtractorDetector(MotionDetector):
+    """
+    Движок "mog2": фоновая модель OpenCV (BackgroundSubtractorMOG2).
+    threshold используется как varThreshold модели, тени отбрасываются
+    """
+
+    engine = "mog2"
+
+    def __init__(self, mask=None, detection_size=None, blur_size=(21, 21),
+                 history=500, learning_rate=-1):
+        self.history = history
+        self.learning_rate = learning_rate
+        self.subtractor = None
+        self.var_threshold = None
+        self.model_ready = False
+        super().__init__(mask, detection_size, blur_size)
+
+    def reset(self):
+        super().reset()
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(
+            history=self.history, detectShadows=True
+        )
+        self.var_threshold = None
+        self.model_ready = False
+
+    def _foreground(self, current_blur, threshold):
+        if threshold != self.var_threshold:
+            self.subtractor.setVarThreshold(threshold)
+            self.var_threshold = threshold
+
+        fg_mask = self.subtractor.apply(current_blur, learningRate=self.learning_rate)
+        if not self.model_ready:
+            # Первый кадр только инициализирует модель
+            self.model_ready = True
+            return None
+
+        # Тени MOG2 помечает значением 127
+        return cv2.threshold(fg_mask, 200, 255, cv2.THRESH_BINARY)[1]
+
+
+MOTION_ENGINES = {
+    MotionDetector.engine: MotionDetector,
+    RunningAverageDetector.engine: RunningAverageDetector,
+    BackgroundSubtractorDetector.engine: BackgroundSubtractorDetector,
+}
+
+
+def create_motion_detector(engine="diff", mask=None, detection_size=None):
+    """Создание детектора движения по имени движка"""
+    if engine not in MOTION_ENGINES:
+        raise ValueError(f"Неизвестный движок детекции: {engine}")
+    return MOTION_ENGINES[engine](mask, detection_size)
+
 
 def detect_motion(prev_frame, current_frame, threshold=25, min_area=500, mask=None):
     """
@@ -9,44 +264,10 @@ def detect_motion(prev_frame, current_frame, threshold=25, min_area=500, mask=No
     """
     if prev_frame is None or current_frame is None:
         return False, []
-    
-    # Конвертация в оттенки серого
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    current_gray = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-    
-    # Размытие для уменьшения шума
-    prev_blur = cv2.GaussianBlur(prev_gray, (21, 21), 0)
-    current_blur = cv2.GaussianBlur(current_gray, (21, 21), 0)
-    
-    # Применение маски если она есть
-    if mask is not None:
-        prev_blur = cv2.bitwise_and(prev_blur, prev_blur, mask=cv2.bitwise_not(mask))
-        current_blur = cv2.bitwise_and(current_blur, current_blur, mask=cv2.bitwise_not(mask))
-    
-    # Вычисление разницы между кадрами
-    frame_delta = cv2.absdiff(prev_blur, current_blur)
-    
-    # Бинаризация разницы
-    thresh = cv2.threshold(frame_delta, threshold, 255, cv2.THRESH_BINARY)[1]
-    
-    # Морфологические операции для улучшения детектирования
-    kernel = np.ones((5, 5), np.uint8)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-    thresh = cv2.dilate(thresh, None, iterations=2)
-    
-    # Поиск контуров
-    contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    motion_detected = False
-    significant_contours = []
-    
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        if area > min_area:
-            motion_detected = True
-            significant_contours.append(contour)
-    
-    return motion_detected, significant_contours
+
+    detector = MotionDetector(mask)
+    detector.detect(prev_frame)
+    return detector.detect(current_frame, threshold, min_area)
 
 def draw_motion_visualization(frame, contours, camera_idx, mask=None, time_left=None):
     """
@@ -59,7 +280,7 @@ def draw_motion_visualization(frame, contours, camera_idx, mask=None, time_left=
     
     # Накладываем маску если есть
     if mask is not None:
-        output_frame = overlay_mask(output_frame, mask)
+        output_frame = overlay_mask(output_frame, mask, in_place=True)
     
     object_count = 0
     
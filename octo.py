@@ -1,13 +1,17 @@
 import cv2
 import time
 import os
-from motion_detection import detect_motion, draw_motion_visualization
-from face_detection import load_face_detection_model, detect_faces
+from motion_detection import MOTION_ENGINES, create_motion_detector, draw_motion_visualization
+from face_detection import (
+    load_face_detection_model, draw_faces, motion_regions, update_faces,
+    FaceDetectionWorker, FaceTracker, face_stats
+)
 from camera_utils import (
-    initialize_cameras, release_cameras, create_video_grid,
-    get_no_signal_frame, get_waiting_frame,
+    initialize_cameras, release_cameras, GridCompositor, grid_layout,
+    placeholders,
     MaskCreator, load_mask, overlay_mask
 )
+from capture import CaptureManager
 from view_logs import view_logs
 
 print(r"""________  ____________________________        /\ __________.___
@@ -24,17 +28,22 @@ class SurveillanceSystem:
     def __init__(self):
         self.camera_indices = [0, 1, 2, 3]
         self.caps = []
+        self.capture = None
         self.face_net = None
+        self.face_worker = None
         self.masks = {}  # {camera_idx: mask}
 
         # Состояние камер
         self.motion_detected = {idx: False for idx in self.camera_indices}
-        self.prev_frames = {idx: None for idx in self.camera_indices}
+        self.motion_engines = {idx: "diff" for idx in self.camera_indices}
+        self.motion_detectors = {}
         self.last_motion_time = {idx: 0 for idx in self.camera_indices}
         self.last_motion_check = {idx: 0 for idx in self.camera_indices}
         self.motion_start_time = {idx: 0 for idx in self.camera_indices}
         self.motion_contours = {idx: [] for idx in self.camera_indices}
         self.last_check_time = {idx: 0 for idx in self.camera_indices}
+        self.compositor = GridCompositor(grid_layout(len(self.camera_indices)), (640, 480))
+        self.camera_status = {idx: None for idx in self.camera_indices}
 
         self.camera_triggered = []
         self.camera_faces = []
@@ -43,8 +52,16 @@ class SurveillanceSystem:
         self.CHECK_INTERVAL = 1
         self.MOTION_THRESHOLD = 25
         self.MOTION_MIN_AREA = 500
+        self.DETECTION_SIZE = (320, 240)  # None - детекция в полном разрешении
+        self.RENDER_IDLE_TIMEOUT = 0.05  # сколько ждать новый кадр, прежде чем опросить клавиатуру
+
+        for idx in self.camera_indices:
+            self.set_motion_engine(idx, self.motion_engines[idx])
 
         self.active_motion_cameras = set()
+        self.FACE_RESULT_MAX_AGE = 2.0  # результаты лиц старше этого не рисуются
+        self.FACE_MODE = "full"  # "motion" - лица ищутся только в зонах движения
+        self.face_trackers = {}  # {camera_idx: FaceTracker} - DNN раз в N кадров + трекинг
         self.mask_creator = MaskCreator()
 
     def main_menu(self):
@@ -79,9 +96,14 @@ class SurveillanceSystem:
         except Exception as e:
             motion_logger.log_system_event(f"Ошибка загрузки модели лиц: {e}")
             self.face_net = None
+        if self.face_net:
+            self.face_worker = FaceDetectionWorker(self.face_net)
+            self.face_worker.start()
 
         # Инициализация камер
         self.caps = initialize_cameras(self.camera_indices)
+        self.capture = CaptureManager(self.caps, self.camera_indices)
+        self.capture.start()
 
         # Загрузка масок
         self.load_all_masks()
@@ -104,13 +126,49 @@ class SurveillanceSystem:
                     parts = filename.split('_')
                     camera_idx = int(parts[1])
                     mask_path = os.path.join(masks_dir, filename)
-                    mask = load_mask(mask_path)
+                    mask = load_mask(mask_path, compiled=True)
                     if mask is not None:
-                        self.masks[camera_idx] = mask
+                        self.set_camera_mask(camera_idx, mask)
                         motion_logger.log_system_event(f"Загружена маска для камеры {camera_idx}")
                 except (ValueError, IndexError):
                     continue
 
+    def set_camera_mask(self, camera_idx, mask):
+        """Установка маски камеры вместе с детектором движения"""
+        self.masks[camera_idx] = mask
+        if camera_idx in self.motion_detectors:
+            self.motion_detectors[camera_idx].set_mask(mask)
+
+    def set_motion_engine(self, camera_idx, engine):
+        """Смена движка детекции движения для камеры"""
+        self.motion_detectors[camera_idx] = create_motion_detector(
+            engine, self.masks.get(camera_idx), self.DETECTION_SIZE
+        )
+        self.motion_engines[camera_idx] = engine
+
+    def set_detection_size(self, detection_size):
+        """Смена разрешения детекции для всех камер; None - полное разрешение"""
+        if detection_size is not None:
+            if not isinstance(detection_size, (list, tuple)) or len(detection_size) != 2 or not all(
+                    isinstance(value, int) and not isinstance(value, bool) and 0 < value <= 4096
+                    for value in detection_size):
+                raise ValueError(f"Неверное разрешение детекции: {detection_size}")
+            detection_size = tuple(detection_size)
+        self.DETECTION_SIZE = detection_size
+        for cam_idx in self.camera_indices:
+            self.set_motion_engine(cam_idx, self.motion_engines[cam_idx])
+
+    def read_camera_list(self):
+        """Чтение списка камер; номера вне camera_indices отбрасываются"""
+        try:
+            cameras = list(map(int, input("  ").split()))
+        except Exception:
+            return []
+        ignored = [cam_idx for cam_idx in cameras if cam_idx not in self.camera_indices]
+        if ignored:
+            print(f"\033[93mНет таких камер, пропущены: {ignored}\033[0m")
+        return [cam_idx for cam_idx in cameras if cam_idx in self.camera_indices]
+
     def get_user_settings(self):
         """Получение настроек от пользователя"""
         print("\n\033[96mНастройка системы\033[0m")
@@ -118,24 +176,35 @@ class SurveillanceSystem:
 
         print("Введите номера камер для детектирования лиц:")
         print("Доступные камеры:", self.camera_indices)
-        try:
-            self.camera_faces = list(map(int, input("  ").split()))
-        except Exception:
-            self.camera_faces = []
+        self.camera_faces = self.read_camera_list()
 
         print("\nВведите номера камер для детектирования движения:")
         print("Доступные камеры:", self.camera_indices)
-        try:
-            self.camera_motion = list(map(int, input("  ").split()))
-        except Exception:
-            self.camera_motion = []
+        self.camera_motion = self.read_camera_list()
 
         print("\nВведите номера камер, которые только включаются по движению:")
         print("Доступные камеры:", self.camera_indices)
+        self.camera_triggered = self.read_camera_list()
+
+        print("\nДвижки детекции движения (камера:движок, Enter = diff для всех):")
+        print("Доступные движки:", ", ".join(MOTION_ENGINES))
+        for item in input("  ").split():
+            try:
+                cam_idx, engine = item.split(":")
+                if int(cam_idx) not in self.camera_indices:
+                    raise ValueError(cam_idx)
+                self.set_motion_engine(int(cam_idx), engine)
+            except ValueError:
+                print(f"\033[93mНеверный движок: {item}\033[0m")
+
+        print(f"\nРазрешение детекции движения (например 160x120, Enter = {self.DETECTION_SIZE}):")
         try:
-            self.camera_triggered = list(map(int, input("  ").split()))
-        except Exception:
-            self.camera_triggered = []
+            value = input("  ").strip()
+            if value:
+                width, height = map(int, value.lower().split("x"))
+                self.set_detection_size((width, height))
+        except ValueError:
+            print(f"\033[93mНеверное разрешение, оставлено {self.DETECTION_SIZE}\033[0m")
 
         print("\nВведите время таймаута после движения:")
         try:
@@ -143,6 +212,20 @@ class SurveillanceSystem:
         except Exception:
             pass
 
+        print("\nТрекинг лиц: детекция раз в N кадров (камера:N, Enter = каждый кадр):")
+        for item in input("  ").split():
+            try:
+                cam_idx, detect_every = item.split(":")
+                if int(cam_idx) not in self.camera_indices:
+                    raise ValueError(cam_idx)
+                self.set_face_tracking(int(cam_idx), int(detect_every))
+            except ValueError:
+                print(f"\033[93mНеверное значение: {item}\033[0m")
+
+        print("\nИскать лица только в зонах движения (y/n):")
+        if input("  ").lower() == 'y':
+            self.FACE_MODE = "motion"
+
         # Настройка масок
         print("\nНастроить маски для камер (y/n):")
         if input("  ").lower() == 'y':
@@ -156,9 +239,14 @@ class SurveillanceSystem:
             'timeout': self.MOTION_TIMEOUT,
             'threshold': self.MOTION_THRESHOLD,
             'min_area': self.MOTION_MIN_AREA,
+            'engines': self.motion_engines,
+            'detection_size': self.DETECTION_SIZE,
+            'face_mode': self.FACE_MODE,
+            'face_tracking': {cam: t.detect_every for cam, t in self.face_trackers.items()},
             'masks': list(self.masks.keys())
         }
         motion_logger.log_settings(settings)
+        motion_logger.archive_logs_async()
 
         # Статус камер
         for cam_idx in self.camera_indices:
@@ -181,16 +269,19 @@ class SurveillanceSystem:
         if self.motion_detected[camera_idx]:
             # АКТИВНЫЙ РЕЖИМ
             if current_time - self.last_motion_check.get(camera_idx, 0) > 0.5:
-                if self.prev_frames[camera_idx] is not None:
-                    motion, contours = detect_motion(
-                        self.prev_frames[camera_idx], frame,
-                        self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, mask
+                if self.FACE_MODE == "motion" and camera_idx in self.camera_faces:
+                    # Контуры нужны для выбора зон поиска лиц
+                    motion, self.motion_contours[camera_idx] = self.motion_detectors[camera_idx].detect(
+                        frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
+                    )
+                else:
+                    motion = self.motion_detectors[camera_idx].has_motion(
+                        frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
                     )
-                    if motion:
-                        self.last_motion_time[camera_idx] = current_time
-                        motion_logger.log_system_event(f"Cam{camera_idx}: Движение продолжается")
+                if motion:
+                    self.last_motion_time[camera_idx] = current_time
+                    motion_logger.log_system_event(f"Cam{camera_idx}: Движение продолжается")
                 self.last_motion_check[camera_idx] = current_time
-                self.prev_frames[camera_idx] = frame.copy()
 
             # Проверка таймаута
             time_since_last_motion = current_time - self.last_motion_time[camera_idx]
@@ -201,56 +292,44 @@ class SurveillanceSystem:
                     motion_logger.log_motion_stopped(camera_idx, duration, 0)
                     self.active_motion_cameras.remove(camera_idx)
                 self.motion_detected[camera_idx] = False
+                self.motion_contours[camera_idx] = []
                 self.last_check_time[camera_idx] = current_time
                 motion_logger.log_camera_status(camera_idx, "Переход в режим ожидания")
-                return get_waiting_frame(camera_idx)
+                return placeholders.waiting(camera_idx, mask=mask)
 
             # Активный кадр (без контуров — просто индикатор активного состояния)
             display_frame = draw_motion_visualization(frame, [], camera_idx, mask, time_left)
 
-            if camera_idx in self.camera_faces and self.face_net:
-                display_frame, face_boxes = detect_faces(self.face_net, display_frame)
-                if face_boxes:
-                    cv2.putText(display_frame, f"Faces: {len(face_boxes)}",
-                               (15, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-            return display_frame
+            return self.process_faces(camera_idx, frame, display_frame, (0, 0, 255),
+                                      self.motion_contours[camera_idx])
 
         else:
             # РЕЖИМ ОЖИДАНИЯ
             time_since_last_check = current_time - self.last_check_time[camera_idx]
             if time_since_last_check >= self.CHECK_INTERVAL:
-                if self.prev_frames[camera_idx] is not None:
-                    motion, _ = detect_motion(
-                        self.prev_frames[camera_idx], frame,
-                        self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, mask
-                    )
-                    if motion:
-                        self.motion_detected[camera_idx] = True
-                        self.last_motion_time[camera_idx] = current_time
-                        self.motion_start_time[camera_idx] = current_time
-                        self.last_motion_check[camera_idx] = current_time
-                        motion_logger.log_motion_detected(camera_idx, is_triggered=True)
-                        self.active_motion_cameras.add(camera_idx)
-                        self.prev_frames[camera_idx] = frame.copy()
-                        return draw_motion_visualization(frame, [], camera_idx, mask, self.MOTION_TIMEOUT)
+                motion = self.motion_detectors[camera_idx].has_motion(
+                    frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
+                )
+                if motion:
+                    self.motion_detected[camera_idx] = True
+                    self.last_motion_time[camera_idx] = current_time
+                    self.motion_start_time[camera_idx] = current_time
+                    self.last_motion_check[camera_idx] = current_time
+                    motion_logger.log_motion_detected(camera_idx, is_triggered=True)
+                    self.active_motion_cameras.add(camera_idx)
+                    return draw_motion_visualization(frame, [], camera_idx, mask, self.MOTION_TIMEOUT)
                 self.last_check_time[camera_idx] = current_time
-                self.prev_frames[camera_idx] = frame.copy()
 
             next_check = int(self.CHECK_INTERVAL - (current_time - self.last_check_time[camera_idx]))
-            waiting_frame = get_waiting_frame(camera_idx, max(0, next_check))
-            if mask is not None:
-                waiting_frame = overlay_mask(waiting_frame, mask)
-            return waiting_frame
+            return placeholders.waiting(camera_idx, max(0, next_check), mask)
 
     def process_motion_camera(self, camera_idx, frame, current_time):
         """Обработка камеры с детектированием движения"""
         mask = self.masks.get(camera_idx)
 
         if self.motion_detected[camera_idx]:
-            motion, contours = detect_motion(
-                self.prev_frames[camera_idx], frame,
-                self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, mask
+            motion, contours = self.motion_detectors[camera_idx].detect(
+                frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
             )
             if motion:
                 self.last_motion_time[camera_idx] = current_time
@@ -259,6 +338,8 @@ class SurveillanceSystem:
                 if objects_info['new_objects']:
                     motion_logger.log_new_objects(camera_idx, objects_info)
                 motion_logger.log_motion_summary(camera_idx, objects_info)
+            else:
+                motion_logger.log_motion_idle(camera_idx)
 
             time_since_last_motion = current_time - self.last_motion_time[camera_idx]
             time_left = int(self.MOTION_TIMEOUT - time_since_last_motion)
@@ -272,64 +353,75 @@ class SurveillanceSystem:
                 self.motion_contours[camera_idx] = []
                 self.last_check_time[camera_idx] = current_time
                 motion_logger.log_camera_status(camera_idx, "Переход в режим ожидания")
-                return get_waiting_frame(camera_idx)
+                return placeholders.waiting(camera_idx, mask=mask)
 
-            self.prev_frames[camera_idx] = frame.copy()
             display_frame = draw_motion_visualization(frame, self.motion_contours[camera_idx], camera_idx, mask, time_left)
 
-            if camera_idx in self.camera_faces and self.face_net:
-                display_frame, face_boxes = detect_faces(self.face_net, display_frame)
-                if face_boxes:
-                    cv2.putText(display_frame, f"Faces: {len(face_boxes)}",
-                               (15, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            return display_frame
+            return self.process_faces(camera_idx, frame, display_frame, (0, 0, 255), contours)
 
         else:
             time_since_last_check = current_time - self.last_check_time[camera_idx]
             if time_since_last_check >= self.CHECK_INTERVAL:
-                if self.prev_frames[camera_idx] is not None:
-                    motion, contours = detect_motion(
-                        self.prev_frames[camera_idx], frame,
-                        self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, mask
-                    )
-                    if motion:
-                        self.motion_detected[camera_idx] = True
-                        self.last_motion_time[camera_idx] = current_time
-                        self.motion_start_time[camera_idx] = current_time
-                        self.motion_contours[camera_idx] = contours
-                        objects_info = motion_logger.track_objects(camera_idx, contours)
-                        if objects_info['new_objects']:
-                            motion_logger.log_new_objects(camera_idx, objects_info)
-                        motion_logger.log_motion_detected(camera_idx)
-                        motion_logger.log_motion_summary(camera_idx, objects_info)
-                        self.active_motion_cameras.add(camera_idx)
-                        self.prev_frames[camera_idx] = frame.copy()
-                        return draw_motion_visualization(frame, contours, camera_idx, mask, self.MOTION_TIMEOUT)
+                # Контуры не нужны: объекты начнут отслеживаться со следующего кадра
+                motion = self.motion_detectors[camera_idx].has_motion(
+                    frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
+                )
+                if motion:
+                    self.motion_detected[camera_idx] = True
+                    self.last_motion_time[camera_idx] = current_time
+                    self.motion_start_time[camera_idx] = current_time
+                    self.motion_contours[camera_idx] = []
+                    motion_logger.log_motion_detected(camera_idx)
+                    self.active_motion_cameras.add(camera_idx)
+                    return draw_motion_visualization(frame, [], camera_idx, mask, self.MOTION_TIMEOUT)
                 self.last_check_time[camera_idx] = current_time
-                self.prev_frames[camera_idx] = frame.copy()
 
             next_check = int(self.CHECK_INTERVAL - (current_time - self.last_check_time[camera_idx]))
-            waiting_frame = get_waiting_frame(camera_idx, max(0, next_check))
-            if mask is not None:
-                waiting_frame = overlay_mask(waiting_frame, mask)
-            return waiting_frame
+            return placeholders.waiting(camera_idx, max(0, next_check), mask)
 
     def process_static_camera(self, camera_idx, frame):
         """Обработка статической камеры"""
         display_frame = frame.copy()
         mask = self.masks.get(camera_idx)
         if mask is not None:
-            display_frame = overlay_mask(display_frame, mask)
-        if camera_idx in self.camera_faces and self.face_net:
-            display_frame, face_boxes = detect_faces(self.face_net, display_frame)
-            if face_boxes:
-                cv2.putText(display_frame, f"Faces: {len(face_boxes)}",
-                           (15, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            display_frame = overlay_mask(display_frame, mask, in_place=True)
+        return self.process_faces(camera_idx, frame, display_frame, (0, 255, 0))
+
+    def set_face_tracking(self, camera_idx, detect_every, min_score=0.6):
+        """Детекция лиц раз в detect_every кадров с трекингом между ними (1 - каждый кадр)"""
+        if detect_every <= 1:
+            self.face_trackers.pop(camera_idx, None)
+        else:
+            self.face_trackers[camera_idx] = FaceTracker(detect_every, min_score)
+
+    def process_faces(self, camera_idx, frame, display_frame, color, contours=None):
+        """
+        Отправка кадра в фоновый детектор лиц и отрисовка последних известных лиц.
+        Отображение не ждет DNN: рядом со счетчиком выводится возраст результата.
+        В режиме FACE_MODE = "motion" сеть видит только зоны вокруг contours,
+        а без движения не запускается вовсе
+        """
+        if camera_idx not in self.camera_faces or self.face_worker is None:
+            return display_frame
+
+        regions = None
+        if self.FACE_MODE == "motion" and contours is not None:
+            regions = motion_regions(contours, (frame.shape[1], frame.shape[0]))
+        tracker = self.face_trackers.get(camera_idx)
+        faces, timestamp = update_faces(self.face_worker, camera_idx, frame, tracker, regions)
+        if timestamp is None:
+            return display_frame
+        age = time.time() - timestamp
+        # Рамки трекера проверены на текущем кадре, ограничение возраста не нужно
+        if faces and (tracker is not None or age <= self.FACE_RESULT_MAX_AGE):
+            draw_faces(display_frame, faces)
+            cv2.putText(display_frame, f"Faces: {len(faces)} ({age:.1f}s)",
+                       (15, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
         return display_frame
 
     def process_camera_frame(self, camera_idx, frame, current_time):
         if frame is None:
-            return get_no_signal_frame(camera_idx)
+            return placeholders.no_signal(camera_idx)
 
         frame = cv2.resize(frame, (640, 480))
 
@@ -365,34 +457,50 @@ class SurveillanceSystem:
                 mask_name = input("  ").strip() or "default"
                 mask_path = self.mask_creator.create_mask(cam_idx, mask_name)
                 if mask_path:
-                    mask = load_mask(mask_path)
+                    mask = load_mask(mask_path, compiled=True)
                     if mask is not None:
-                        self.masks[cam_idx] = mask
+                        self.set_camera_mask(cam_idx, mask)
                         motion_logger.log_system_event(f"\033[92mСоздана маска для камеры {cam_idx}\033[0m")
 
     def run(self):
         try:
             self.initialize()
+            last_status_second = None
             while True:
-                frames = []
+                # Ждем кадр от любой камеры; таймаут - чтобы обрабатывать клавиши
+                self.capture.wait_frame(self.RENDER_IDLE_TIMEOUT)
                 current_time = time.time()
-                for idx, cap in enumerate(self.caps):
-                    camera_idx = self.camera_indices[idx]
-                    if cap.isOpened():
-                        ret, frame = cap.read()
-                        if ret:
-                            processed_frame = self.process_camera_frame(camera_idx, frame, current_time)
-                        else:
-                            processed_frame = get_no_signal_frame(camera_idx)
-                            motion_logger.log_camera_status(camera_idx, "Нет сигнала")
+                has_new_frames = False
+                tiles_changed = False
+                for tile_idx, camera_idx in enumerate(self.camera_indices):
+                    tile_frame = None
+                    if self.capture.is_opened(camera_idx):
+                        frame, _, is_new = self.capture.read(camera_idx)
+                        if frame is None:
+                            tile_frame = placeholders.no_signal(camera_idx)
+                            self.set_camera_status(camera_idx, "Нет сигнала")
+                        elif is_new:
+                            tile_frame = self.process_camera_frame(camera_idx, frame, current_time)
+                            self.set_camera_status(camera_idx, None)
+                            has_new_frames = True
+                        # иначе новый кадр еще не пришел - в тайле остается прежний результат
                     else:
-                        processed_frame = get_no_signal_frame(camera_idx)
-                        motion_logger.log_camera_status(camera_idx, "Не найдена")
-                    frames.append(cv2.resize(processed_frame, (320, 240)))
-
-                grid = create_video_grid(frames, (2, 2), (640, 480))
-                self.add_status_info(grid, current_time)
-                cv2.imshow("Multi-Camera Surveillance System", grid)
+                        tile_frame = placeholders.no_signal(camera_idx)
+                        self.set_camera_status(camera_idx, "Не найдена")
+
+                    if tile_frame is not None:
+                        # У заглушек из кэша есть ключ - неизменившийся тайл не перерисовывается
+                        tiles_changed |= self.compositor.update_tile(
+                            tile_idx, tile_frame, placeholders.key_for(tile_frame)
+                        )
+
+                # Сетка перерисовывается только при изменениях; отсчеты в статусе - раз в секунду
+                if has_new_frames or tiles_changed or int(current_time) != last_status_second:
+                    last_status_second = int(current_time)
+                    # Статус рисуется на копии, чтобы не портить тайлы холста
+                    grid = self.compositor.canvas.copy()
+                    self.add_status_info(grid, current_time)
+                    cv2.imshow("Multi-Camera Surveillance System", grid)
 
                 key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
@@ -408,6 +516,13 @@ class SurveillanceSystem:
         finally:
             self.cleanup()
 
+    def set_camera_status(self, camera_idx, status):
+        """Логирует проблему с камерой только при смене состояния"""
+        if self.camera_status[camera_idx] != status:
+            self.camera_status[camera_idx] = status
+            if status is not None:
+                motion_logger.log_camera_status(camera_idx, status)
+
     def add_status_info(self, grid, current_time):
         status_lines = []
         for cam_idx in self.camera_indices:
@@ -449,7 +564,7 @@ class SurveillanceSystem:
                 self.active_motion_cameras.discard(cam_idx)
 
             self.motion_detected[cam_idx] = False
-            self.prev_frames[cam_idx] = None
+            self.motion_detectors[cam_idx].reset()
             self.last_motion_time[cam_idx] = 0
             self.last_motion_check[cam_idx] = 0
             self.last_check_time[cam_idx] = time.time()
@@ -478,11 +593,21 @@ class SurveillanceSystem:
             total_objects = motion_logger.object_counter.get(cam_idx, 0)
             motion_logger.log_motion_stopped(cam_idx, duration, total_objects)
 
+        if self.face_worker is not None:
+            self.face_worker.stop()
+            motion_logger.log_system_event(
+                f"Статистика детектирования лиц: {face_stats.summary()}, {self.face_worker.get_stats()}"
+            )
+            for cam_idx, tracker in self.face_trackers.items():
+                motion_logger.log_system_event(f"Cam{cam_idx}: трекинг лиц {tracker.get_stats()}")
         motion_logger.log_system_event("Завершение работы системы")
 
         # Освобождение ресурсов
+        if self.capture is not None:
+            self.capture.stop()
         release_cameras(self.caps)
         cv2.destroyAllWindows()
+        motion_logger.flush()
 
 
 if __name__ == "__main__":
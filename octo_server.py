@@ -1,21 +1,33 @@
+import asyncio
+import codecs
+import collections
 import socket
 import struct
 import cv2
 import json
 import threading
-import numpy as np
 import time
 import os
 import sys
 
+try:
+    import fcntl
+    import termios
+except ImportError:  # не Unix - очередь отправки ядра недоступна
+    fcntl = termios = None
+
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from motion_detection import detect_motion, draw_motion_visualization
-from face_detection import load_face_detection_model
+from motion_detection import create_motion_detector, draw_motion_visualization
+from face_detection import (
+    load_face_detection_model, draw_faces, motion_regions, update_faces,
+    FaceDetectionWorker, FaceTracker, face_stats
+)
 from camera_utils import (
-    initialize_cameras, release_cameras, create_video_grid,
-    get_no_signal_frame, get_waiting_frame
+    initialize_cameras, release_cameras, GridCompositor, grid_layout,
+    placeholders
 )
+from capture import CaptureManager
 from logger import motion_logger
 
 
@@ -48,11 +60,14 @@ class HeadlessSurveillanceSystem:
     def __init__(self):
         self.camera_indices = self.detect_cameras()
         self.caps = []
+        self.capture = None
         self.face_net = None
+        self.face_worker = None
 
         # Состояние
         self.motion_detected = {}
-        self.prev_frames = {}
+        self.motion_engines = {}
+        self.motion_detectors = {}
         self.last_motion_time = {}
         self.last_motion_check = {}
         self.motion_start_time = {}
@@ -61,7 +76,7 @@ class HeadlessSurveillanceSystem:
 
         for cam_idx in self.camera_indices:
             self.motion_detected[cam_idx] = False
-            self.prev_frames[cam_idx] = None
+            self.motion_engines[cam_idx] = "diff"
             self.last_motion_time[cam_idx] = 0
             self.last_motion_check[cam_idx] = 0
             self.motion_start_time[cam_idx] = 0
@@ -69,38 +84,63 @@ class HeadlessSurveillanceSystem:
             self.last_check_time[cam_idx] = 0
 
         self.camera_triggered = self.camera_indices[:]  # камеры с включением по движению
-        self.camera_faces = self.camera_indices[:]      # камеры для лиц
+        self.camera_faces = []  # камеры для лиц: включаются командой enable_face
         self.camera_motion = self.camera_indices[:]     # камеры для движения
         self.MOTION_TIMEOUT = 30
         self.CHECK_INTERVAL = 1
         self.MOTION_THRESHOLD = 25
         self.MOTION_MIN_AREA = 500
+        self.DETECTION_SIZE = (320, 240)  # None - детекция в полном разрешении
+
+        for cam_idx in self.camera_indices:
+            self.set_motion_engine(cam_idx, self.motion_engines[cam_idx])
 
         self.active_motion_cameras = set()
+        # Не меньше 2x2, как раньше; пустые тайлы заполняются "No signal"
+        self.compositor = GridCompositor(grid_layout(max(4, len(self.camera_indices))), (640, 480))
+        self.FACE_RESULT_MAX_AGE = 2.0  # результаты лиц старше этого не рисуются
+        self.FACE_MODE = "full"  # "motion" - лица ищутся только в зонах движения
+        self.face_trackers = {}  # {camera_idx: FaceTracker} - DNN раз в N кадров + трекинг
 
     def detect_cameras(self):
-    working_cameras = []
-    print("[SYSTEM] Поиск доступных камер...")
-
-    for i in range(10):  # проверим /dev/video0 ... /dev/video9
-        cap = cv2.VideoCapture(i)
-        if cap.isOpened():
-            ret, frame = cap.read()
-            if ret and frame is not None:
-                working_cameras.append(i)
-                print(f"[SYSTEM] Камера {i} найдена - OK")
+        working_cameras = []
+        print("[SYSTEM] Поиск доступных камер...")
+
+        for i in range(10):  # проверим /dev/video0 ... /dev/video9
+            cap = cv2.VideoCapture(i)
+            if cap.isOpened():
+                ret, frame = cap.read()
+                if ret and frame is not None:
+                    working_cameras.append(i)
+                    print(f"[SYSTEM] Камера {i} найдена - OK")
+                else:
+                    print(f"[SYSTEM] Камера {i} не возвращает кадры")
+                cap.release()
             else:
-                print(f"[SYSTEM] Камера {i} не возвращает кадры")
-            cap.release()
-        else:
-            print(f"[SYSTEM] Камера {i} не открывается")
+                print(f"[SYSTEM] Камера {i} не открывается")
 
-    if not working_cameras:
-        print("[SYSTEM] Предупреждение: не найдено ни одной камеры!")
-        return []
+        if not working_cameras:
+            print("[SYSTEM] Предупреждение: не найдено ни одной камеры!")
+            return []
 
-    return working_cameras
+        return working_cameras
 
+    def set_motion_engine(self, camera_idx, engine):
+        """Смена движка детекции движения для камеры"""
+        self.motion_detectors[camera_idx] = create_motion_detector(engine, None, self.DETECTION_SIZE)
+        self.motion_engines[camera_idx] = engine
+
+    def set_detection_size(self, detection_size):
+        """Смена разрешения детекции для всех камер; None - полное разрешение"""
+        if detection_size is not None:
+            if not isinstance(detection_size, (list, tuple)) or len(detection_size) != 2 or not all(
+                    isinstance(value, int) and not isinstance(value, bool) and 0 < value <= 4096
+                    for value in detection_size):
+                raise ValueError(f"Неверное разрешение детекции: {detection_size}")
+            detection_size = tuple(detection_size)
+        self.DETECTION_SIZE = detection_size
+        for cam_idx in self.camera_indices:
+            self.set_motion_engine(cam_idx, self.motion_engines[cam_idx])
 
     def initialize(self):
         motion_logger.log_system_event("Инициализация системы видеонаблюдения (HEADLESS)")
@@ -117,36 +157,47 @@ class HeadlessSurveillanceSystem:
                 motion_logger.log_system_event("Файлы модели лиц не найдены")
         except Exception as e:
             motion_logger.log_system_event(f"Ошибка загрузки модели лиц: {e}")
+        if self.face_net:
+            self.face_worker = FaceDetectionWorker(self.face_net)
+            self.face_worker.start()
 
         self.caps = initialize_cameras(self.camera_indices)
+        self.capture = CaptureManager(self.caps, self.camera_indices)
+        self.capture.start()
 
         settings = {
             'working_cameras': self.camera_indices,
             'timeout': self.MOTION_TIMEOUT,
-            'threshold': self.MOTION_THRESHOLD
+            'threshold': self.MOTION_THRESHOLD,
+            'engines': self.motion_engines,
+            'detection_size': self.DETECTION_SIZE
         }
         motion_logger.log_settings(settings)
 
         motion_logger.log_system_event(f"Система инициализирована. Камеры: {self.camera_indices}")
+        motion_logger.archive_logs_async()
 
     def process_camera_frame(self, camera_idx, frame, current_time):
         if frame is None:
-            return get_no_signal_frame(camera_idx)
+            return placeholders.no_signal(camera_idx)
 
         frame = cv2.resize(frame, (640, 480))
 
         if camera_idx in self.camera_triggered and camera_idx in self.camera_motion:
             if self.motion_detected[camera_idx]:
                 if current_time - self.last_motion_check.get(camera_idx, 0) > 0.5:
-                    if self.prev_frames[camera_idx] is not None:
-                        motion, contours = detect_motion(
-                            self.prev_frames[camera_idx], frame,
-                            self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, None
+                    if self.FACE_MODE == "motion" and camera_idx in self.camera_faces:
+                        # Контуры нужны для выбора зон поиска лиц
+                        motion, self.motion_contours[camera_idx] = self.motion_detectors[camera_idx].detect(
+                            frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
                         )
-                        if motion:
-                            self.last_motion_time[camera_idx] = current_time
+                    else:
+                        motion = self.motion_detectors[camera_idx].has_motion(
+                            frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
+                        )
+                    if motion:
+                        self.last_motion_time[camera_idx] = current_time
                     self.last_motion_check[camera_idx] = current_time
-                    self.prev_frames[camera_idx] = frame.copy()
 
                 time_since_last_motion = current_time - self.last_motion_time[camera_idx]
                 time_left = int(self.MOTION_TIMEOUT - time_since_last_motion)
@@ -156,230 +207,1193 @@ class HeadlessSurveillanceSystem:
                         motion_logger.log_motion_stopped(camera_idx, duration, 0)
                         self.active_motion_cameras.remove(camera_idx)
                     self.motion_detected[camera_idx] = False
+                    self.motion_contours[camera_idx] = []
                     self.last_check_time[camera_idx] = current_time
-                    return get_waiting_frame(camera_idx)
+                    return placeholders.waiting(camera_idx)
 
                 display_frame = draw_motion_visualization(frame, [], camera_idx, None, time_left)
-                return display_frame
+                return self.process_faces(camera_idx, frame, display_frame, self.motion_contours[camera_idx])
 
             else:
                 time_since_last_check = current_time - self.last_check_time[camera_idx]
                 if time_since_last_check >= self.CHECK_INTERVAL:
-                    if self.prev_frames[camera_idx] is not None:
-                        motion, _ = detect_motion(
-                            self.prev_frames[camera_idx], frame,
-                            self.MOTION_THRESHOLD, self.MOTION_MIN_AREA, None
-                        )
-                        if motion:
-                            self.motion_detected[camera_idx] = True
-                            self.last_motion_time[camera_idx] = current_time
-                            self.motion_start_time[camera_idx] = current_time
-                            self.last_motion_check[camera_idx] = current_time
-                            motion_logger.log_motion_detected(camera_idx, is_triggered=True)
-                            self.active_motion_cameras.add(camera_idx)
-                            self.prev_frames[camera_idx] = frame.copy()
-                            return draw_motion_visualization(frame, [], camera_idx, None, self.MOTION_TIMEOUT)
+                    motion = self.motion_detectors[camera_idx].has_motion(
+                        frame, self.MOTION_THRESHOLD, self.MOTION_MIN_AREA
+                    )
+                    if motion:
+                        self.motion_detected[camera_idx] = True
+                        self.last_motion_time[camera_idx] = current_time
+                        self.motion_start_time[camera_idx] = current_time
+                        self.last_motion_check[camera_idx] = current_time
+                        motion_logger.log_motion_detected(camera_idx, is_triggered=True)
+                        self.active_motion_cameras.add(camera_idx)
+                        return draw_motion_visualization(frame, [], camera_idx, None, self.MOTION_TIMEOUT)
                     self.last_check_time[camera_idx] = current_time
-                    self.prev_frames[camera_idx] = frame.copy()
 
                 next_check = int(self.CHECK_INTERVAL - (current_time - self.last_check_time[camera_idx]))
-                return get_waiting_frame(camera_idx, max(0, next_check))
+                return placeholders.waiting(camera_idx, max(0, next_check))
+
+        return self.process_faces(camera_idx, frame, frame)
+
+    def set_face_tracking(self, camera_idx, detect_every, min_score=0.6):
+        """Детекция лиц раз в detect_every кадров с трекингом между ними (1 - каждый кадр)"""
+        if detect_every <= 1:
+            self.face_trackers.pop(camera_idx, None)
+        else:
+            self.face_trackers[camera_idx] = FaceTracker(detect_every, min_score)
 
-        return frame
+    def process_faces(self, camera_idx, frame, display_frame, contours=None):
+        """
+        Отправка кадра в фоновый детектор лиц и отрисовка последних известных лиц.
+        В режиме FACE_MODE = "motion" сеть видит только зоны вокруг contours
+        """
+        if camera_idx not in self.camera_faces or self.face_worker is None:
+            return display_frame
+
+        regions = None
+        if self.FACE_MODE == "motion" and contours is not None:
+            regions = motion_regions(contours, (frame.shape[1], frame.shape[0]))
+        tracker = self.face_trackers.get(camera_idx)
+        faces, timestamp = update_faces(self.face_worker, camera_idx, frame, tracker, regions)
+        if timestamp is None:
+            return display_frame
+        age = time.time() - timestamp
+        # Рамки трекера проверены на текущем кадре, ограничение возраста не нужно
+        if faces and (tracker is not None or age <= self.FACE_RESULT_MAX_AGE):
+            if display_frame is frame:
+                # Исходный кадр еще читает поток детектора
+                display_frame = frame.copy()
+            draw_faces(display_frame, faces)
+            cv2.putText(display_frame, f"Faces: {len(faces)} ({age:.1f}s)",
+                       (15, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        return display_frame
 
     def get_grid_frame(self):
-        frames = []
         current_time = time.time()
 
-        for idx, cap in enumerate(self.caps):
-            camera_idx = self.camera_indices[idx]
-            if cap.isOpened():
-                ret, frame = cap.read()
-                if ret:
-                    processed_frame = self.process_camera_frame(camera_idx, frame, current_time)
-                else:
-                    processed_frame = get_no_signal_frame(camera_idx)
+        for tile_idx, camera_idx in enumerate(self.camera_indices):
+            frame, _, is_new = self.capture.read(camera_idx)
+            if frame is None:
+                tile_frame = placeholders.no_signal(camera_idx)
+            elif is_new:
+                tile_frame = self.process_camera_frame(camera_idx, frame, current_time)
             else:
-                processed_frame = get_no_signal_frame(camera_idx)
-
-            small_frame = cv2.resize(processed_frame, (320, 240))
-            frames.append(small_frame)
+                # Камера еще не отдала новый кадр - в тайле остается прежний результат
+                continue
+            # У заглушек из кэша есть ключ - неизменившийся тайл не перерисовывается
+            self.compositor.update_tile(tile_idx, tile_frame, placeholders.key_for(tile_frame))
 
-        while len(frames) < 4:
-            frames.append(get_no_signal_frame(len(frames)))
+        for tile_idx in range(len(self.camera_indices), len(self.compositor.tiles)):
+            tile_frame = placeholders.no_signal(tile_idx)
+            self.compositor.update_tile(tile_idx, tile_frame, placeholders.key_for(tile_frame))
 
-        grid = create_video_grid(frames, (2, 2), (640, 480))
-        return grid
+        return self.compositor.canvas
 
     def cleanup(self):
         for cam_idx in list(self.active_motion_cameras):
             duration = time.time() - self.motion_start_time[cam_idx]
             motion_logger.log_motion_stopped(cam_idx, duration, 0)
 
+        if self.face_worker is not None:
+            self.face_worker.stop()
         motion_logger.log_system_event("Завершение работы системы")
+        if self.capture is not None:
+            self.capture.stop()
         release_cameras(self.caps)
+        motion_logger.flush()
+
+
+class FrameBroadcaster:
+    """
+    Раздача видеопотока: каждая новая сетка кодируется в JPEG один раз на вариант
+    (качество, масштаб), готовое сообщение (длина + байты) получает номер
+    последовательности. Кодируются только варианты, у которых есть подписчики.
+    После публикации вызываются слушатели (пробуждение event loop)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._version = None
+        self._variants = {}  # (качество, масштаб) -> число подписчиков
+        self._payloads = {}  # (качество, масштаб) -> (seq, сообщение, время публикации)
+        self._listeners = []
+
+        # Счетчики
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+        self.encode_time = 0.0
+
+    @property
+    def subscribers(self):
+        return sum(self._variants.values())
+
+    def subscribe(self, variant=(80, 1.0)):
+        with self._lock:
+            self._variants[variant] = self._variants.get(variant, 0) + 1
+
+    def unsubscribe(self, variant=(80, 1.0)):
+        with self._lock:
+            self._variants[variant] -= 1
+            if self._variants[variant] <= 0:
+                del self._variants[variant]
+                self._payloads.pop(variant, None)
+
+    def add_listener(self, callback):
+        """callback() вызывается из потока обработки после каждой публикации"""
+        self._listeners.append(callback)
+
+    def publish(self, frame, version=None):
+        """
+        Кодирование и публикация кадра. Без клиентов кадр не кодируется;
+        version - признак содержимого: если он не изменился, кодируются
+        только варианты, для которых еще нет сообщения
+        """
+        with self._lock:
+            variants = list(self._variants)
+            missing = [variant for variant in variants if variant not in self._payloads]
+        if not variants:
+            self._version = None
+            return False
+
+        new_frame = version is None or version != self._version
+        if not new_frame and not missing:
+            self.frames_skipped += 1
+            return False
+        if new_frame:
+            self._version = version
+            self._seq += 1
+
+        resized = {1.0: frame}
+        encoded = False
+        for quality, scale in (variants if new_frame else missing):
+            start = time.perf_counter()
+            if scale not in resized:
+                size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+                resized[scale] = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            success, buffer = cv2.imencode('.jpg', resized[scale], [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            if not success:
+                continue
+            jpg_bytes = buffer.tobytes()
+            payload = struct.pack(">L", len(jpg_bytes)) + jpg_bytes
+
+            with self._lock:
+                self.encode_time += time.perf_counter() - start
+                self.frames_encoded += 1
+                if (quality, scale) in self._variants:
+                    self._payloads[(quality, scale)] = (self._seq, payload, time.time())
+            encoded = True
+
+        if encoded:
+            for callback in self._listeners:
+                callback()
+        return encoded
+
+    def latest(self, variant=(80, 1.0)):
+        """Последний опубликованный кадр варианта: (seq, payload, timestamp)"""
+        with self._lock:
+            return self._payloads.get(variant, (0, None, 0.0))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': sum(self._variants.values()),
+                'variants': {f"q{quality} x{scale}": count
+                             for (quality, scale), count in self._variants.items()},
+                'seq': self._seq,
+                'encoded': self.frames_encoded,
+                'skipped_unchanged': self.frames_skipped,
+                'encode_ms': (self.encode_time / self.frames_encoded * 1000
+                              if self.frames_encoded else 0.0),
+            }
+
+
+class TileBroadcaster:
+    """
+    Режим тайлов: вместо всей сетки кодируется только изменившийся тайл
+    (один раз на версию тайла в GridCompositor). Сообщение тайла - заголовок
+    TILE_HEADER (длина JPEG, индекс, x, y, w, h, ширина и высота холста) + JPEG
+    """
+
+    TILE_HEADER = struct.Struct(">LBHHHHHH")
+
+    def __init__(self, quality=80):
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._tiles = {}  # индекс -> (версия, сообщение, время публикации)
+        self._listeners = []
+        self.subscribers = 0
+
+        # Счетчики
+        self.tiles_encoded = 0
+        self.encode_time = 0.0
+
+    def subscribe(self):
+        with self._lock:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._lock:
+            self.subscribers -= 1
+
+    def add_listener(self, callback):
+        """callback() вызывается из потока обработки, если изменился хотя бы один тайл"""
+        self._listeners.append(callback)
+
+    def publish(self, compositor):
+        """Кодирование тайлов, версия которых изменилась. Без клиентов ничего не кодируется"""
+        if not self.subscribers:
+            # Кэш устарел бы без клиентов - новый клиент получит тайлы со следующего кадра
+            with self._lock:
+                self._tiles.clear()
+            return False
+
+        canvas_w, canvas_h = compositor.output_size
+        tile_w, tile_h = compositor.tile_size
+        cols = compositor.grid_size[1]
+        changed = False
+        for index, tile in enumerate(compositor.tiles):
+            version = compositor.tile_versions[index]
+            cached = self._tiles.get(index)
+            if cached is not None and cached[0] == version:
+                continue
+
+            start = time.perf_counter()
+            success, buffer = cv2.imencode('.jpg', tile, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            if not success:
+                continue
+            jpg_bytes = buffer.tobytes()
+            header = self.TILE_HEADER.pack(
+                len(jpg_bytes), index, (index % cols) * tile_w, (index // cols) * tile_h,
+                tile_w, tile_h, canvas_w, canvas_h
+            )
+            with self._lock:
+                self.encode_time += time.perf_counter() - start
+                self.tiles_encoded += 1
+                self._tiles[index] = (version, header + jpg_bytes, time.time())
+            changed = True
+
+        if changed:
+            for callback in self._listeners:
+                callback()
+        return changed
+
+    def changed_since(self, known_versions):
+        """Тайлы новее известных клиенту: [(индекс, версия, сообщение, время публикации)]"""
+        with self._lock:
+            return [
+                (index, version, payload, timestamp)
+                for index, (version, payload, timestamp) in sorted(self._tiles.items())
+                if known_versions.get(index) != version
+            ]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': self.subscribers,
+                'encoded': self.tiles_encoded,
+                'encode_ms': (self.encode_time / self.tiles_encoded * 1000
+                              if self.tiles_encoded else 0.0),
+            }
+
+
+class CameraStreamBroadcaster:
+    """
+    Потоки отдельных камер в исходном (или заказанном) разрешении.
+    Поток задается ключом (камера, размер, качество, масштаб); каждый ключ
+    кодируется один раз на новый кадр захвата, сколько бы клиентов его ни смотрело,
+    и только пока у него есть подписчики. Формат сообщений как у сетки: длина + JPEG
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}  # ключ -> состояние потока
+        self._listeners = []
+
+        # Счетчики
+        self.frames_encoded = 0
+        self.encode_errors = 0
+        self.encode_time = 0.0
+
+    def add_listener(self, callback):
+        """callback() вызывается из потока обработки, если закодирован хотя бы один кадр"""
+        self._listeners.append(callback)
+
+    def subscribe(self, camera_idx, size=None, quality=80, scale=1.0):
+        """
+        Подписка на поток камеры; size = (w, h) или None - исходное разрешение,
+        scale - дополнительное уменьшение (ступень RateController). Возвращает ключ
+        """
+        key = (camera_idx, tuple(size) if size else None, int(quality), scale)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = {'subscribers': 0, 'capture_seq': 0,
+                          'payload': None, 'timestamp': 0.0}
+                self._streams[key] = stream
+            stream['subscribers'] += 1
+        return key
+
+    def unsubscribe(self, key):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                return
+            stream['subscribers'] -= 1
+            if stream['subscribers'] <= 0:
+                del self._streams[key]
+
+    def publish(self, capture):
+        """Кодирование новых кадров захвата для потоков с подписчиками"""
+        with self._lock:
+            streams = list(self._streams.items())
+
+        changed = False
+        for key, stream in streams:
+            camera_idx, size, quality, scale = key
+            frame, timestamp, capture_seq = capture.peek(camera_idx)
+            if frame is None or capture_seq == stream['capture_seq']:
+                continue
+
+            start = time.perf_counter()
+            width, height = size or (frame.shape[1], frame.shape[0])
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            try:
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                success, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            except Exception as e:
+                # Ошибка одного потока не должна останавливать цикл обработки
+                success = False
+                if not stream.get('error'):
+                    print(f"[SERVER] Ошибка потока камеры {key}: {e}")
+                stream['error'] = str(e)
+            if not success:
+                with self._lock:
+                    self.encode_errors += 1
+                    stream['capture_seq'] = capture_seq
+                continue
+            jpg_bytes = buffer.tobytes()
+            payload = struct.pack(">L", len(jpg_bytes)) + jpg_bytes
+
+            with self._lock:
+                self.encode_time += time.perf_counter() - start
+                self.frames_encoded += 1
+                stream['capture_seq'] = capture_seq
+                stream['payload'] = payload
+                stream['timestamp'] = timestamp
+            changed = True
+
+        if changed:
+            for callback in self._listeners:
+                callback()
+        return changed
+
+    def latest(self, key):
+        """
+        Последний кадр потока: (seq, payload, время захвата). seq - номер кадра захвата,
+        поэтому он сравним между ключами одной камеры при смене ступени
+        """
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                return 0, None, 0.0
+            return stream['capture_seq'], stream['payload'], stream['timestamp']
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'streams': {
+                    f"cam{camera_idx} {f'{size[0]}x{size[1]}' if size else 'native'} q{quality} x{scale}":
+                        stream['subscribers']
+                    for (camera_idx, size, quality, scale), stream in self._streams.items()
+                },
+                'encoded': self.frames_encoded,
+                'errors': self.encode_errors,
+                'encode_ms': (self.encode_time / self.frames_encoded * 1000
+                              if self.frames_encoded else 0.0),
+            }
+
+
+def tcp_rtt(sock):
+    """RTT соединения в секундах из TCP_INFO (только Linux); None - недоступно"""
+    if sock is None or not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except OSError:
+        return None
+    if len(info) < 72:
+        return None
+    # struct tcp_info: 8 байт флагов, затем u32; tcpi_rtt - 16-е поле (мкс)
+    return struct.unpack_from("I", info, 68)[0] / 1e6
+
+
+def socket_outq(sock):
+    """
+    Байт в очереди отправки ядра: еще не отправлены или не подтверждены клиентом
+    (SIOCOUTQ, Linux). None - недоступно
+    """
+    if sock is None or fcntl is None or not hasattr(termios, "TIOCOUTQ"):
+        return None
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0"))[0]
+    except (OSError, ValueError):  # ValueError - сокет уже закрыт
+        return None
+
+
+class RateController:
+    """
+    Подстройка потока под канал клиента. По измеренной пропускной способности,
+    RTT и задержке доставки выбирается ступень (качество JPEG, масштаб, кадров/с)
+    так, чтобы задержка укладывалась в target_latency. Ступени фиксированы,
+    поэтому клиенты с одинаковым каналом делят одни и те же закодированные варианты.
+    Задержка и пропускная способность берутся из подтвержденной доставки
+    (on_delivered); без нее - из времени drain() (on_sent)
+    """
+
+    LEVELS = [
+        # (качество, масштаб, кадров/с)
+        (80, 1.0, 30),
+        (70, 1.0, 30),
+        (60, 1.0, 20),
+        (50, 0.75, 15),
+        (40, 0.5, 10),
+        (30, 0.5, 5),
+    ]
+    DOWN_COOLDOWN = 1.0  # понижение не чаще раза в секунду
+    UP_HOLD = 3.0        # столько секунд задержка должна быть низкой для повышения
+    EWMA_ALPHA = 0.3
+    BUSY_WINDOW = 2.0    # пропускная способность - по доставке за последний отрезок занятости канала
+    MIN_BUSY_TIME = 0.005
+
+    def __init__(self, target_latency=0.3, adaptive=True, level=0):
+        self.target_latency = target_latency
+        self.adaptive = adaptive
+        self.level = level
+
+        self.throughput = None  # байт/с
+        self.frame_size = None  # байт
+        self.rtt = None         # с, из TCP_INFO
+        self.latency = 0.0      # от публикации до доставки, с
+        self._last_change = 0.0
+        self._good_since = None
+        self._last_sent = 0.0
+        self._last_delivered = 0.0
+        self._busy_start = None
+        self._busy_bytes = 0
+
+    @property
+    def quality(self):
+        return self.LEVELS[self.level][0]
+
+    @property
+    def scale(self):
+        return self.LEVELS[self.level][1]
+
+    @property
+    def fps(self):
+        return self.LEVELS[self.level][2]
+
+    def wait_time(self):
+        """Сколько подождать до следующего кадра, чтобы не превысить fps ступени"""
+        return max(0.0, self._last_sent + 1.0 / self.fps - time.time())
+
+    def _ewma(self, old, value):
+        return value if old is None else old + self.EWMA_ALPHA * (value - old)
+
+    def on_sent(self, size, started, timestamp, rtt=None, track_delivery=False):
+        """
+        Учет отправленного кадра: size байт, отправка началась в started,
+        кадр опубликован в timestamp. При track_delivery задержку и пропускную
+        способность даст on_delivered, иначе их отражает только время drain()
+        """
+        now = time.time()
+        self._last_sent = started
+        if track_delivery:
+            self.frame_size = self._ewma(self.frame_size, size)
+            if rtt is not None:
+                self.rtt = self._ewma(self.rtt, rtt)
+            return
+        send_time = now - started
+        if send_time > 0.002:  # мгновенная запись в буфер ничего не говорит о канале
+            self.throughput = self._ewma(self.throughput, size / send_time)
+        self.frame_size = self._ewma(self.frame_size, size)
+        if rtt is not None:
+            self.rtt = self._ewma(self.rtt, rtt)
+        self.latency = self._ewma(self.latency, now - timestamp + (self.rtt or 0.0) / 2)
+        if self.adaptive:
+            self._adapt(now)
+
+    def on_delivered(self, size, started, timestamp):
+        """
+        Клиент подтвердил кадр (size байт, записан в сокет в started, опубликован в timestamp).
+        Пропускная способность - байты, доставленные за отрезок, пока канал был занят:
+        отрезок начинается с отправки кадра, если к этому моменту все прежнее уже доставлено
+        """
+        now = time.time()
+        if (self._busy_start is None or started > self._last_delivered
+                or now - self._busy_start > self.BUSY_WINDOW):
+            self._busy_start = max(started, self._last_delivered)
+            self._busy_bytes = 0
+        self._busy_bytes += size
+        self._last_delivered = now
+        self.throughput = self._ewma(
+            self.throughput, self._busy_bytes / max(now - self._busy_start, self.MIN_BUSY_TIME)
+        )
+        # ACK приходит примерно через RTT/2 после получения кадра клиентом
+        latency = max(0.0, now - timestamp - (self.rtt or 0.0) / 2)
+        self.latency = self._ewma(self.latency, latency)
+        if self.adaptive:
+            self._adapt(now)
+
+    def _fits(self, margin):
+        """Поток ступени (размер кадра * fps) с запасом margin помещается в канал"""
+        if self.throughput is None or self.frame_size is None:
+            return True
+        return self.frame_size * self.fps * margin <= self.throughput
+
+    def _adapt(self, now):
+        # Канал не успевает за fps ступени - кадры теряются, даже если задержка в норме
+        if self.latency > self.target_latency or not self._fits(1.0):
+            self._good_since = None
+            if self.level < len(self.LEVELS) - 1 and now - self._last_change >= self.DOWN_COOLDOWN:
+                self.level += 1
+                self._last_change = now
+        elif self.latency < self.target_latency / 2 and self._fits(1.5) and self.level > 0:
+            if self._good_since is None:
+                self._good_since = now
+            elif now - self._good_since >= self.UP_HOLD:
+                self.level -= 1
+                self._last_change = now
+                self._good_since = None
+        else:
+            self._good_since = None
+
+    def configure(self, target_latency=None, adaptive=None, level=None):
+        if target_latency is not None:
+            if float(target_latency) <= 0:
+                raise ValueError("Целевая задержка должна быть больше нуля")
+            self.target_latency = float(target_latency)
+        if adaptive is not None:
+            self.adaptive = bool(adaptive)
+        if level is not None:
+            level = int(level)
+            if not 0 <= level < len(self.LEVELS):
+                raise ValueError(f"Ступень должна быть от 0 до {len(self.LEVELS) - 1}")
+            self.level = level
+            self._good_since = None
+
+    def get_stats(self):
+        return {
+            'level': self.level,
+            'quality': self.quality,
+            'scale': self.scale,
+            'fps': self.fps,
+            'adaptive': self.adaptive,
+            'target_latency_ms': self.target_latency * 1000,
+            'latency_ms': self.latency * 1000,
+            'rtt_ms': self.rtt * 1000 if self.rtt is not None else None,
+            'frame_kb': self.frame_size / 1024 if self.frame_size else None,
+            'throughput_kbps': self.throughput * 8 / 1000 if self.throughput else None,
+        }
+
+
+class VideoClient:
+    """
+    Отправка видео одному клиенту. Очередь глубиной 1: пока отправляется
+    текущий кадр, новые не копятся - берется только самый свежий,
+    остальные считаются пропущенными.
+    drain() видит только буфер транспорта, поэтому перед следующим кадром
+    wait_delivery() ждет, пока клиент подтвердит (ACK) прежние данные из очереди
+    ядра (SIOCOUTQ). Устаревшие кадры не копятся в буфере сокета, а задержка
+    считается до доставки. Без SIOCOUTQ остается ограничение по drain()
+    """
+
+    SEND_BUFFER = 64 * 1024
+    STALL_TIMEOUT = 5.0            # клиент не принимает данные дольше - отключаем
+    DELIVERY_BACKLOG = 8 * 1024    # столько недоставленных байт допустимо перед новым кадром
+    DELIVERY_POLL = 0.005          # период опроса очереди ядра
+
+    def __init__(self, writer, addr, rate=None):
+        self.writer = writer
+        self.addr = addr
+        self.rate = rate or RateController()
+        self.last_seq = 0
+        self.tile_versions = {}  # режим тайлов: индекс -> отправленная версия
+        self.connected_at = time.time()
+
+        # Счетчики
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_delivered = 0
+        self.bytes_sent = 0
+        self.queue_age = 0.0      # возраст кадра в момент начала отправки
+        self.latency_total = 0.0  # от публикации до доставки (без SIOCOUTQ - до drain())
+
+        # Доставка: смещения концов отправленных кадров в общем потоке байт
+        self.bytes_written = 0
+        self.undelivered = 0
+        self._in_flight = collections.deque()  # (конец кадра, размер, timestamp, started)
+        self._written = asyncio.Event()
+
+        self.sock = writer.get_extra_info('socket')
+        if self.sock is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(high=self.SEND_BUFFER)
+        self.track_delivery = socket_outq(self.sock) is not None
+
+    def _write(self, payload, timestamp, started):
+        self.writer.write(payload)
+        self.bytes_written += len(payload)
+        if self.track_delivery:
+            self._in_flight.append((self.bytes_written, len(payload), timestamp, started))
+            self._written.set()
+
+    def check_delivery(self):
+        """Учет кадров, которые клиент уже подтвердил; возвращает число недоставленных байт"""
+        outq = socket_outq(self.sock)
+        if outq is None:
+            return 0
+        self.undelivered = outq + self.writer.transport.get_write_buffer_size()
+        delivered = self.bytes_written - self.undelivered
+        now = time.time()
+        while self._in_flight and self._in_flight[0][0] <= delivered:
+            _, size, timestamp, started = self._in_flight.popleft()
+            self.frames_delivered += 1
+            self.latency_total += now - timestamp
+            self.rate.on_delivered(size, started, timestamp)
+        return self.undelivered
+
+    async def monitor_delivery(self):
+        """
+        Фоновая задача клиента: пока есть неподтвержденные кадры, очередь ядра
+        опрашивается каждые DELIVERY_POLL - время доставки известно с этой точностью,
+        независимо от того, когда цикл отправки возьмет следующий кадр
+        """
+        if not self.track_delivery:
+            return
+        while True:
+            await self._written.wait()
+            self._written.clear()
+            while self._in_flight:
+                self.check_delivery()
+                if self._in_flight:
+                    await asyncio.sleep(self.DELIVERY_POLL)
+
+    async def wait_delivery(self):
+        """
+        Ожидание, пока недоставленных данных не станет меньше DELIVERY_BACKLOG.
+        Новый кадр выбирается уже после этого - пока канал занят, кадры пропускаются
+        """
+        if not self.track_delivery:
+            return
+        deadline = time.time() + self.STALL_TIMEOUT
+        while self.check_delivery() > self.DELIVERY_BACKLOG:
+            if time.time() > deadline:
+                raise asyncio.TimeoutError("клиент не подтверждает данные")
+            await asyncio.sleep(self.DELIVERY_POLL)
+
+    async def send_frame(self, seq, payload, timestamp):
+        """Отправка одного сообщения целиком; TimeoutError - клиент завис"""
+        if self.last_seq and seq > self.last_seq + 1:
+            self.frames_dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+        started = time.time()
+        self.queue_age = started - timestamp
+
+        self._write(payload, timestamp, started)
+        await asyncio.wait_for(self.writer.drain(), self.STALL_TIMEOUT)
+
+        self.frames_sent += 1
+        self.bytes_sent += len(payload)
+        if not self.track_delivery:
+            self.latency_total += time.time() - timestamp
+        self.rate.on_sent(len(payload), started, timestamp, tcp_rtt(self.sock), self.track_delivery)
+
+    async def send_tiles(self, tiles):
+        """Отправка изменившихся тайлов одной пачкой; промежуточные версии считаются пропущенными"""
+        started = now = time.time()
+        for index, version, payload, timestamp in tiles:
+            known = self.tile_versions.get(index)
+            if known is not None and version > known + 1:
+                self.frames_dropped += version - known - 1
+            self.tile_versions[index] = version
+            self.queue_age = now - timestamp
+            self._write(payload, timestamp, started)
+        await asyncio.wait_for(self.writer.drain(), self.STALL_TIMEOUT)
+
+        now = time.time()
+        for _, _, payload, timestamp in tiles:
+            self.frames_sent += 1
+            self.bytes_sent += len(payload)
+            if not self.track_delivery:
+                self.latency_total += now - timestamp
+        self.rate.on_sent(sum(len(tile[2]) for tile in tiles), started,
+                          min(tile[3] for tile in tiles), tcp_rtt(self.sock), self.track_delivery)
+
+    def get_stats(self):
+        elapsed = max(time.time() - self.connected_at, 1e-6)
+        counted = self.frames_delivered if self.track_delivery else self.frames_sent
+        return {
+            'sent': self.frames_sent,
+            'delivered': self.frames_delivered if self.track_delivery else None,
+            'dropped': self.frames_dropped,
+            'fps': self.frames_sent / elapsed,
+            'kbps': self.bytes_sent * 8 / 1000 / elapsed,
+            'queue_age_ms': self.queue_age * 1000,
+            'undelivered_kb': self.undelivered / 1024,
+            'latency_ms': self.latency_total / counted * 1000 if counted else 0.0,
+            'rate': self.rate.get_stats(),
+        }
+
+
+def split_messages(decoder, buffer):
+    """
+    Выделение JSON-сообщений из начала буфера команд. Сообщения разделяются
+    переводом строки, но склеенные или разрезанные TCP-пакеты тоже разбираются.
+    Возвращает (сообщения, остаток); ошибка разбора - экземпляр ValueError в списке
+    """
+    messages = []
+    pos = 0
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            return messages, ""
+        try:
+            message, pos = decoder.raw_decode(buffer, pos)
+            messages.append(message)
+        except ValueError as e:
+            newline = buffer.find("\n", pos)
+            if newline == -1:
+                # Сообщение еще не дошло целиком - ждем продолжения
+                return messages, buffer[pos:]
+            messages.append(e)
+            pos = newline + 1
 
 
 class OctoServer:
+    FRAME_INTERVAL = 0.033
+    MAX_COMMAND_SIZE = 64 * 1024
+    # Команды, меняющие настройки: в ответ добавляется итоговая конфигурация
+    SETTING_ACTIONS = {
+        "set_timeout", "set_threshold", "enable_face", "disable_face", "enable_motion",
+        "disable_motion", "set_engine", "set_detection_size", "set_face_mode",
+        "set_face_tracking", "set_stream", "batch",
+    }
+    HELLO_TIMEOUT = 0.5  # ожидание необязательного приветствия видео-клиента
+    MAX_STREAM_SIDE = 4096  # предел ширины/высоты потока камеры
+    # Команды с блокирующим вводом-выводом (SQLite) выполняются вне event loop
+    BLOCKING_ACTIONS = {"get_events"}
+
     def __init__(self):
         self.system = HeadlessSurveillanceSystem()
         self.system.initialize()
         self.running = True
-        self.current_grid = None
-        self.frame_lock = threading.Lock()
+        self.broadcaster = FrameBroadcaster()
+        self.tile_broadcaster = TileBroadcaster(quality=80)
+        self.camera_broadcaster = CameraStreamBroadcaster()
+        self.video_clients = {}
+        # Настройки RateController для новых клиентов (команда set_stream)
+        self.stream_defaults = {'target_latency': 0.3, 'adaptive': True, 'level': 0}
+        self._frame_event = None
+        self._stop_event = None
+        self._connections = {}  # задача клиента -> writer
 
         self.system_thread = threading.Thread(target=self.run_system_loop)
         self.system_thread.daemon = True
         self.system_thread.start()
 
     def run_system_loop(self):
-        try:
-            while self.running:
+        while self.running:
+            start = time.time()
+            # Ошибка одной итерации не останавливает обработку для всех клиентов
+            try:
                 grid_frame = self.system.get_grid_frame()
-                with self.frame_lock:
-                    self.current_grid = grid_frame.copy()
-                time.sleep(0.033)
-        except Exception as e:
-            print(f"[SYSTEM] Ошибка: {e}")
+                # Кодирование здесь же, до следующего обновления холста - копия не нужна
+                versions = tuple(self.system.compositor.tile_versions)
+                self.broadcaster.publish(grid_frame, versions)
+                self.tile_broadcaster.publish(self.system.compositor)
+                self.camera_broadcaster.publish(self.system.capture)
+            except Exception as e:
+                print(f"[SYSTEM] Ошибка: {e}")
+            time.sleep(max(0.0, self.FRAME_INTERVAL - (time.time() - start)))
 
-    def get_grid_frame(self):
-        with self.frame_lock:
-            if self.current_grid is not None:
-                return self.current_grid.copy()
-            else:
-                return np.zeros((480, 640, 3), dtype=np.uint8)
+    def _frame_published(self):
+        """Вызывается в event loop после публикации кадра: будит всех видео-клиентов"""
+        self._frame_event.set()
+        self._frame_event = asyncio.Event()
 
-    def video_stream(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT_VIDEO))
-        server_socket.listen(5)
-        print(f"[SERVER] Видео-сервер слушает на {HOST}:{PORT_VIDEO}")
+    async def read_hello(self, reader):
+        """
+        Необязательная первая строка видео-клиента:
+        {"mode": "tiles"} - режим тайлов,
+        {"camera": 0, "width": 1280, "height": 720, "quality": 90} - поток одной камеры
+        (width/height не заданы - исходное разрешение).
+        Старые клиенты ничего не присылают - для них режим сетки
+        """
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.HELLO_TIMEOUT)
+            hello = json.loads(line.decode("utf-8")) if line.strip() else {}
+        except (asyncio.TimeoutError, ValueError):
+            return {}
+        return hello if isinstance(hello, dict) else {}
 
-        while self.running:
-            try:
-                conn, addr = server_socket.accept()
-                print(f"[SERVER] Видео-клиент подключен: {addr}")
-                client_thread = threading.Thread(target=self.handle_video_client, args=(conn, addr))
-                client_thread.daemon = True
-                client_thread.start()
-            except Exception as e:
-                if self.running:
-                    print(f"[SERVER] Ошибка: {e}")
+    async def wait_frame(self, frame_event):
+        try:
+            await asyncio.wait_for(frame_event.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    def parse_video_request(self, hello):
+        """Режим видео-клиента по приветствию; ValueError/TypeError - некорректный запрос"""
+        camera_idx = hello.get("camera")
+        if camera_idx is not None:
+            if camera_idx not in self.system.camera_indices:
+                raise ValueError(f"Камера {camera_idx} не найдена")
+            size = None
+            if hello.get("width") is not None or hello.get("height") is not None:
+                size = (hello.get("width"), hello.get("height"))
+                if not all(isinstance(value, int) and not isinstance(value, bool)
+                           and 0 < value <= self.MAX_STREAM_SIDE for value in size):
+                    raise ValueError(f"Неверный размер потока: {size[0]}x{size[1]}")
+            quality = min(100, max(10, int(hello.get("quality", 80))))
+            return {'mode': "camera", 'camera': camera_idx, 'size': size, 'quality': quality}
+        return {'mode': "tiles" if hello.get("mode") == "tiles" else "grid"}
+
+    def subscribe_stream(self, request, rate):
+        """
+        Подписка на вариант потока для текущей ступени rate.
+        Возвращает (latest, unsubscribe); в режиме тайлов latest = None
+        """
+        if request['mode'] == "camera":
+            # Качество, заказанное клиентом, - верхняя граница
+            quality = min(request['quality'], rate.quality)
+            key = self.camera_broadcaster.subscribe(request['camera'], request['size'], quality, rate.scale)
+            return (lambda: self.camera_broadcaster.latest(key),
+                    lambda: self.camera_broadcaster.unsubscribe(key))
+        if request['mode'] == "tiles":
+            # Тайлы кодируются одним качеством, подстраивается только частота кадров
+            self.tile_broadcaster.subscribe()
+            return None, self.tile_broadcaster.unsubscribe
+        variant = (rate.quality, rate.scale)
+        self.broadcaster.subscribe(variant)
+        return (lambda: self.broadcaster.latest(variant),
+                lambda: self.broadcaster.unsubscribe(variant))
 
-    def handle_video_client(self, conn, addr):
+    async def handle_video_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')[:2]
+        self._connections[asyncio.current_task()] = writer
+        hello = await self.read_hello(reader)
+        try:
+            request = self.parse_video_request(hello)
+        except (TypeError, ValueError) as e:
+            print(f"[SERVER] Видео-клиент {addr} отклонен: {e}")
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+            return
+
+        mode_name = {"camera": f"камера {hello.get('camera')}", "tiles": "тайлы", "grid": "сетка"}
+        print(f"[SERVER] Видео-клиент подключен: {addr} ({mode_name[request['mode']]})")
+        client = VideoClient(writer, addr, RateController(**self.stream_defaults))
+        rate = client.rate
+        self.video_clients[addr] = client
+        level = rate.level
+        latest, unsubscribe = self.subscribe_stream(request, rate)
+        monitor = asyncio.create_task(client.monitor_delivery())
         try:
             while self.running:
-                grid_frame = self.get_grid_frame()
-
-                if grid_frame is not None:
-                    success, buffer = cv2.imencode('.jpg', grid_frame, [
-                        int(cv2.IMWRITE_JPEG_QUALITY), 80
-                    ])
-                    if success:
-                        # ✅ теперь отправляем чистый JPEG-байтстрим
-                        jpg_bytes = buffer.tobytes()
-                        message_size = struct.pack(">L", len(jpg_bytes))
-                        try:
-                            conn.sendall(message_size + jpg_bytes)
-                        except (BrokenPipeError, ConnectionResetError):
-                            break
-                time.sleep(0.033)
+                if rate.level != level:
+                    # Ступень сменилась - переходим на другой вариант кодирования
+                    unsubscribe()
+                    level = rate.level
+                    latest, unsubscribe = self.subscribe_stream(request, rate)
+                delay = rate.wait_time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                # Прежние кадры еще в пути - новый выберем, когда канал освободится
+                await client.wait_delivery()
+
+                # ✅ JPEG уже закодирован один раз для всех клиентов
+                frame_event = self._frame_event
+                if latest is None:
+                    tiles = self.tile_broadcaster.changed_since(client.tile_versions)
+                    if tiles:
+                        await client.send_tiles(tiles)
+                        continue
+                else:
+                    seq, payload, timestamp = latest()
+                    if payload is not None and seq > client.last_seq:
+                        await client.send_frame(seq, payload, timestamp)
+                        continue
+                await self.wait_frame(frame_event)
+        except (BrokenPipeError, ConnectionResetError, asyncio.TimeoutError) as e:
+            if self.running:
+                print(f"[SERVER] Видео-клиент {addr} отключен: {e!r}")
+        except asyncio.CancelledError:
+            pass  # остановка сервера
         except Exception as e:
             print(f"[SERVER] Ошибка: {e}")
         finally:
-            try:
-                conn.close()
-            except:
-                pass
-
-    def command_listener(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT_CMD))
-        server_socket.listen(5)
-        print(f"[SERVER] Командный сервер слушает на {HOST}:{PORT_CMD}")
+            monitor.cancel()
+            unsubscribe()
+            self.video_clients.pop(addr, None)
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
 
-        while self.running:
-            try:
-                conn, addr = server_socket.accept()
-                print(f"[SERVER] Командный клиент подключен: {addr}")
-                client_thread = threading.Thread(target=self.handle_command_client, args=(conn, addr))
-                client_thread.daemon = True
-                client_thread.start()
-            except Exception as e:
-                if self.running:
-                    print(f"[SERVER] Ошибка: {e}")
+    def command_cameras(self, cmd):
+        """Камеры команды: номер, список номеров или "all" - все камеры"""
+        camera = cmd["camera"]
+        if camera == "all":
+            return list(self.system.camera_indices)
+        cameras = camera if isinstance(camera, list) else [camera]
+        unknown = [cam for cam in cameras if cam not in self.system.camera_indices]
+        if unknown:
+            raise ValueError(f"Камеры не найдены: {unknown}")
+        return cameras
 
-    def handle_command_client(self, conn, addr):
+    def get_config(self):
+        """Текущие настройки системы - эхо в ответах на команды настройки"""
+        return {
+            'motion_timeout': self.system.MOTION_TIMEOUT,
+            'motion_threshold': self.system.MOTION_THRESHOLD,
+            'detection_size': self.system.DETECTION_SIZE,
+            'face_mode': self.system.FACE_MODE,
+            'camera_faces': self.system.camera_faces,
+            'camera_motion': self.system.camera_motion,
+            'engines': self.system.motion_engines,
+            'face_tracking': {cam: tracker.detect_every
+                              for cam, tracker in self.system.face_trackers.items()},
+            'stream': self.stream_defaults,
+        }
+
+    def handle_request(self, cmd):
+        """Выполнение команды с перехватом ошибок; id запроса возвращается в ответе"""
+        try:
+            if not isinstance(cmd, dict):
+                raise ValueError("Команда должна быть JSON-объектом")
+            response = self.execute_command(cmd)
+        except Exception as e:
+            response = {"status": "error", "message": str(e)}
+        if isinstance(cmd, dict) and "id" in cmd:
+            response["id"] = cmd["id"]
+        return response
+
+    def execute_command(self, cmd):
+        """Выполнение одной команды, возвращает ответ для клиента"""
+        response = {"status": "ok", "command": cmd["action"]}
+
+        if cmd["action"] == "set_timeout":
+            self.system.MOTION_TIMEOUT = int(cmd["value"])
+        elif cmd["action"] == "set_threshold":
+            self.system.MOTION_THRESHOLD = int(cmd["value"])
+        elif cmd["action"] == "enable_face":
+            for cam in self.command_cameras(cmd):
+                if cam not in self.system.camera_faces:
+                    self.system.camera_faces.append(cam)
+        elif cmd["action"] == "disable_face":
+            for cam in self.command_cameras(cmd):
+                if cam in self.system.camera_faces:
+                    self.system.camera_faces.remove(cam)
+        elif cmd["action"] == "enable_motion":
+            for cam in self.command_cameras(cmd):
+                if cam not in self.system.camera_motion:
+                    self.system.camera_motion.append(cam)
+        elif cmd["action"] == "disable_motion":
+            for cam in self.command_cameras(cmd):
+                if cam in self.system.camera_motion:
+                    self.system.camera_motion.remove(cam)
+        elif cmd["action"] == "set_engine":
+            for cam in self.command_cameras(cmd):
+                self.system.set_motion_engine(cam, cmd["value"])
+        elif cmd["action"] == "set_detection_size":
+            self.system.set_detection_size(cmd["value"] or None)
+        elif cmd["action"] == "set_face_mode":
+            if cmd["value"] not in ("full", "motion"):
+                raise ValueError(f"Неизвестный режим лиц: {cmd['value']}")
+            self.system.FACE_MODE = cmd["value"]
+        elif cmd["action"] == "set_face_tracking":
+            for cam in self.command_cameras(cmd):
+                self.system.set_face_tracking(
+                    cam, int(cmd["value"]), float(cmd.get("min_score", 0.6))
+                )
+        elif cmd["action"] == "batch":
+            # Команды выполняются по порядку; ошибка одной не отменяет остальные
+            self.batch_results(response, [self.handle_request(sub_cmd) for sub_cmd in cmd["commands"]])
+        elif cmd["action"] == "get_config":
+            response["config"] = self.get_config()
+        elif cmd["action"] == "get_stats":
+            response["capture"] = self.system.capture.get_stats()
+            response["video"] = self.broadcaster.get_stats()
+            response["video_tiles"] = self.tile_broadcaster.get_stats()
+            response["video_cameras"] = self.camera_broadcaster.get_stats()
+            response["video_clients"] = {
+                f"{ip}:{port}": client.get_stats()
+                for (ip, port), client in self.video_clients.items()
+            }
+            response["faces"] = face_stats.summary()
+            if self.system.face_worker is not None:
+                response["face_worker"] = self.system.face_worker.get_stats()
+            response["face_tracking"] = {
+                cam: tracker.get_stats() for cam, tracker in self.system.face_trackers.items()
+            }
+            response["logger"] = motion_logger.writer.get_stats()
+        elif cmd["action"] == "set_stream":
+            # Без "client" - для всех клиентов и по умолчанию для новых.
+            # Запрос проверяется целиком до изменений: при ошибке ничего не меняется
+            names = [name for name in ("target_latency", "adaptive", "level") if name in cmd]
+            checked = RateController(**self.stream_defaults)
+            checked.configure(**{name: cmd[name] for name in names})  # проверка и приведение типов
+            settings = {name: getattr(checked, name) for name in names}
+            if cmd.get("client"):
+                clients = [client for (ip, port), client in self.video_clients.items()
+                           if f"{ip}:{port}" == cmd["client"]]
+                if not clients:
+                    raise ValueError(f"Клиент {cmd['client']} не найден")
+            else:
+                self.stream_defaults = {'target_latency': checked.target_latency,
+                                        'adaptive': checked.adaptive, 'level': checked.level}
+                clients = list(self.video_clients.values())
+            for client in clients:
+                client.rate.configure(**settings)
+            response["defaults"] = self.stream_defaults
+        elif cmd["action"] == "get_stream":
+            response["defaults"] = self.stream_defaults
+            response["levels"] = RateController.LEVELS
+            response["clients"] = {
+                f"{ip}:{port}": client.rate.get_stats()
+                for (ip, port), client in self.video_clients.items()
+            }
+        elif cmd["action"] == "get_events":
+            # Пример: {"action": "get_events", "camera": 2, "event": "trigger", "start": <unix-время>}
+            if motion_logger.events is None:
+                raise ValueError("База событий отключена")
+            response["events"] = motion_logger.events.query(
+                cmd.get("start"), cmd.get("end"), cmd.get("camera"), cmd.get("event"),
+                int(cmd.get("limit", 1000)),
+            )
+        elif cmd["action"] == "quit":
+            self.running = False
+            if self._stop_event is not None:
+                self._stop_event.set()
+        else:
+            raise ValueError(f"Неизвестная команда: {cmd['action']}")
+
+        if cmd["action"] in self.SETTING_ACTIONS:
+            response["config"] = self.get_config()
+        return response
+
+    @staticmethod
+    def batch_results(response, results):
+        """Ответы команд пачки в ответе на пачку; при любой ошибке статус - partial"""
+        response["results"] = results
+        if any(result["status"] != "ok" for result in results):
+            response["status"] = "partial"
+
+    def is_blocking(self, cmd):
+        """Одиночная команда блокирует event loop"""
+        return isinstance(cmd, dict) and cmd.get("action") in self.BLOCKING_ACTIONS
+
+    async def dispatch(self, cmd):
+        """
+        Выполнение команды из event loop. Блокирующая команда уходит в поток;
+        в пачке в поток уходят только блокирующие команды, остальные
+        меняют состояние на event loop, как одиночные
+        """
+        if isinstance(cmd, dict) and cmd.get("action") == "batch" and isinstance(cmd.get("commands"), list):
+            response = {"status": "ok", "command": "batch"}
+            self.batch_results(response, [await self.dispatch(sub_cmd) for sub_cmd in cmd["commands"]])
+            response["config"] = self.get_config()
+            if "id" in cmd:
+                response["id"] = cmd["id"]
+            return response
+        if self.is_blocking(cmd):
+            return await asyncio.to_thread(self.handle_request, cmd)
+        return self.handle_request(cmd)
+
+    async def handle_command_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')[:2]
+        print(f"[SERVER] Командный клиент подключен: {addr}")
+        self._connections[asyncio.current_task()] = writer
+        # Одно долгоживущее соединение: JSON-сообщения через перевод строки,
+        # можно отправлять несколько команд подряд, не дожидаясь ответов
+        utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        decoder = json.JSONDecoder()
+        buffer = ""
         try:
             while self.running:
-                conn.settimeout(1.0)
-                try:
-                    data = conn.recv(4096)
-                    if not data:
-                        break
-                except socket.timeout:
-                    continue
+                data = await reader.read(65536)
+                if not data:
+                    break
+
+                messages, buffer = split_messages(decoder, buffer + utf8.decode(data))
+                if len(buffer) > self.MAX_COMMAND_SIZE:
+                    messages.append(ValueError("Слишком длинная команда"))
+                    buffer = ""
 
-                try:
-                    cmd = json.loads(data.decode("utf-8"))
-                    print(f"[SERVER] Команда от {addr}: {cmd}")
-
-                    response = {"status": "ok", "command": cmd["action"]}
-
-                    if cmd["action"] == "set_timeout":
-                        self.system.MOTION_TIMEOUT = int(cmd["value"])
-                    elif cmd["action"] == "set_threshold":
-                        self.system.MOTION_THRESHOLD = int(cmd["value"])
-                    elif cmd["action"] == "enable_face":
-                        cam = cmd["camera"]
-                        if cam not in self.system.camera_faces:
-                            self.system.camera_faces.append(cam)
-                    elif cmd["action"] == "disable_face":
-                        cam = cmd["camera"]
-                        if cam in self.system.camera_faces:
-                            self.system.camera_faces.remove(cam)
-                    elif cmd["action"] == "enable_motion":
-                        cam = cmd["camera"]
-                        if cam not in self.system.camera_motion:
-                            self.system.camera_motion.append(cam)
-                    elif cmd["action"] == "disable_motion":
-                        cam = cmd["camera"]
-                        if cam in self.system.camera_motion:
-                            self.system.camera_motion.remove(cam)
-                    elif cmd["action"] == "quit":
-                        self.running = False
-
-                    conn.send(json.dumps(response).encode("utf-8"))
-
-                except Exception as e:
-                    response = {"status": "error", "message": str(e)}
-                    conn.send(json.dumps(response).encode("utf-8"))
+                for cmd in messages:
+                    if isinstance(cmd, ValueError):
+                        response = {"status": "error", "message": str(cmd)}
+                    else:
+                        print(f"[SERVER] Команда от {addr}: {cmd}")
+                        response = await self.dispatch(cmd)
+                    writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (BrokenPipeError, ConnectionResetError, asyncio.CancelledError):
+            pass
         except Exception as e:
             print(f"[SERVER] Ошибка: {e}")
         finally:
-            try:
-                conn.close()
-            except:
-                pass
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
 
     def stop(self):
         self.running = False
         self.system.cleanup()
 
+    async def serve(self):
+        """Сетевая часть: видео и команды на одном event loop, обработка кадров - в потоках"""
+        loop = asyncio.get_running_loop()
+        self._frame_event = asyncio.Event()
+        self._stop_event = asyncio.Event()
+
+        def wake_loop():
+            try:
+                loop.call_soon_threadsafe(self._frame_published)
+            except RuntimeError:
+                pass  # event loop уже закрыт
+        self.broadcaster.add_listener(wake_loop)
+        self.tile_broadcaster.add_listener(wake_loop)
+        self.camera_broadcaster.add_listener(wake_loop)
+
+        video_server = await asyncio.start_server(self.handle_video_client, HOST, PORT_VIDEO)
+        print(f"[SERVER] Видео-сервер слушает на {HOST}:{PORT_VIDEO}")
+        command_server = await asyncio.start_server(self.handle_command_client, HOST, PORT_CMD)
+        print(f"[SERVER] Командный сервер слушает на {HOST}:{PORT_CMD}")
+
+        print("[SERVER] Сервер запущен! Ctrl+C для остановки")
+        async with video_server, command_server:
+            try:
+                await self._stop_event.wait()
+            finally:
+                # Закрываем соединения сами, чтобы обработчики завершились без отмены.
+                # Клиента с недоставленными данными close() не закроет - обрываем соединение
+                self.running = False
+                self._frame_published()
+                for writer in self._connections.values():
+                    if writer.transport.get_write_buffer_size():
+                        writer.transport.abort()
+                    else:
+                        writer.close()
+                if self._connections:
+                    await asyncio.wait(list(self._connections), timeout=2.0)
+
     def run(self):
         try:
             print("[SERVER] Запуск сервера...")
-            video_thread = threading.Thread(target=self.video_stream)
-            command_thread = threading.Thread(target=self.command_listener)
-            video_thread.daemon = True
-            command_thread.daemon = True
-            video_thread.start()
-            command_thread.start()
-            print("[SERVER] Сервер запущен! Ctrl+C для остановки")
-            while self.running:
-                time.sleep(1)
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             print("\n[SERVER] Остановка...")
         finally:
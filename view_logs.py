@@ -1,44 +1,443 @@
 #!/usr/bin/env python3
+"""
+Просмотр и выборка логов движения.
+
+Без аргументов - интерактивный выбор файла. С аргументами - выборка:
+    python view_logs.py --from "2024-05-01 08:00" --to "2024-05-01 09:00" --camera 2 --tag TRIGGER
+    python view_logs.py --from 2h --tag MOTION OBJECT --format json
+    python view_logs.py --follow -n 20 --camera 1
+
+Записи в файле идут по времени, поэтому начало интервала ищется бинарным
+поиском по смещению в файле, а подходящие строки выводятся потоком.
+Сжатые архивы прошлых дней (.txt.gz, .txt.zst) читаются потоком от начала
+"""
+import argparse
+import collections
+import csv
+import datetime
+import gzip
+import io
+import json
 import os
+import re
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LOGS_DIR = "logs"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_FILE_RE = re.compile(r"^motion_log_(\d{4}-\d{2}-\d{2})\.txt(\.gz|\.zst)?$")
+ENTRY_RE = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] (\[[A-Z0-9]+\]) (.*)$")
+CAMERA_RE = re.compile(r"^Cam(\d+):")
+
 
 def view_logs():
-    logs_dir = "logs"
-    
+    logs_dir = LOGS_DIR
+
     if not os.path.exists(logs_dir):
         print("Папка с логами не найдена!")
         return
-    
+
     # Получаем список файлов логов
-    log_files = [f for f in os.listdir(logs_dir) if f.startswith("motion_log_") and f.endswith(".txt")]
+    log_files = [f for f in os.listdir(logs_dir) if LOG_FILE_RE.match(f)]
     log_files.sort(reverse=True)
-    
+
     if not log_files:
         print("Лог-файлы не найдены!")
         return
-    
+
     print("Доступные лог-файлы:")
     for i, file in enumerate(log_files, 1):
         print(f"{i}. {file}")
-    
+
     try:
         choice = int(input("\nВыберите файл для просмотра (0 для выхода): "))
         if choice == 0:
             return
-        
+
         selected_file = log_files[choice - 1]
         file_path = os.path.join(logs_dir, selected_file)
-        
-        # Показываем содержимое файла
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
+
+        # Показываем содержимое файла построчно, не загружая его целиком
         print(f"\nСодержимое файла {selected_file}:")
         print("=" * 80)
-        print(content)
+        with open_log(file_path) as f:
+            for line in f:
+                sys.stdout.write(line.decode("utf-8", "replace"))
         print("=" * 80)
-        
+
     except (ValueError, IndexError):
         print("Неверный выбор!")
+    except OSError as e:
+        print(f"Не удалось прочитать файл: {e}")
+
+
+# ================== РАЗБОР ==================
+
+def parse_time(value, now=None):
+    """
+    Граница интервала в виде строки "YYYY-MM-DD HH:MM:SS" (так строки сравниваются напрямую).
+    Форматы: "YYYY-MM-DD", "YYYY-MM-DD HH:MM[:SS]", "HH:MM[:SS]" (сегодня),
+    "30m" / "2h" / "7d" - столько времени назад
+    """
+    now = now or datetime.datetime.now()
+    value = value.strip()
+    relative = re.fullmatch(r"(\d+)([smhd])", value)
+    if relative:
+        unit = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}[relative.group(2)]
+        return (now - datetime.timedelta(**{unit: int(relative.group(1))})).strftime(TIME_FORMAT)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.datetime.strptime(value, fmt).time()
+            return datetime.datetime.combine(now.date(), parsed).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Неверное время: {value}")
+
+
+def parse_entry(line):
+    """Строка лога -> (время, тег, камера или None, сообщение) или None для чужих строк"""
+    match = ENTRY_RE.match(line.rstrip("\r\n"))
+    if match is None:
+        return None
+    timestamp, tag, message = match.groups()
+    camera = None
+    if tag.startswith("[CAM"):
+        camera = int(tag[4:-1])
+    else:
+        camera_match = CAMERA_RE.match(message)
+        if camera_match:
+            camera = int(camera_match.group(1))
+    return timestamp, tag, camera, message
+
+
+def line_time(line):
+    """Время записи из сырой строки (bytes) или None"""
+    if len(line) < 21 or line[:1] != b"[" or line[20:21] != b"]":
+        return None
+    return line[1:20].decode("ascii", "replace")
+
+
+# ================== ЧТЕНИЕ ==================
+
+def is_compressed(path):
+    return path.endswith((".gz", ".zst"))
+
+
+def open_log(path):
+    """Открытие лога в бинарном режиме; сжатые файлы распаковываются потоком"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise OSError(f"Для чтения {os.path.basename(path)} нужен пакет zstandard")
+        # Дописанный к архиву день - отдельный кадр zstd, читаются все кадры подряд
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                           closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, "rb")
+
+
+def log_files(logs_dir, start=None, end=None):
+    """
+    Дневные файлы, пересекающиеся с интервалом, по возрастанию даты: [(дата, путь)].
+    Если день есть и в сжатом, и в исходном виде (записи, пришедшие после архивации),
+    сначала идет архив, затем исходный файл
+    """
+    if not os.path.isdir(logs_dir):
+        return []
+    files = []
+    for filename in os.listdir(logs_dir):
+        match = LOG_FILE_RE.match(filename)
+        if match is None:
+            continue
+        day = match.group(1)
+        if start is not None and day < start[:10]:
+            continue
+        if end is not None and day > end[:10]:
+            continue
+        files.append((day, match.group(2) is None, os.path.join(logs_dir, filename)))
+    return [(day, path) for day, _, path in sorted(files)]
+
+
+def _line_start(f, offset):
+    """Начало первой строки, начинающейся не раньше offset"""
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    return f.tell()
+
+
+def _first_time_from(f, offset):
+    """Время первой записи, начинающейся не раньше offset (None - до конца файла записей нет)"""
+    f.seek(_line_start(f, offset))
+    for line in f:
+        timestamp = line_time(line)
+        if timestamp is not None:
+            return timestamp
+    return None
+
+
+def seek_time(f, start):
+    """
+    Бинарный поиск по смещению: ставит f (открытый в "rb") на первую строку
+    со временем >= start. Строки без метки времени пропускаются
+    """
+    lo, hi = 0, os.fstat(f.fileno()).st_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        timestamp = _first_time_from(f, mid)
+        if timestamp is not None and timestamp < start:
+            lo = mid + 1
+        else:
+            hi = mid
+    f.seek(_line_start(f, lo))
+
+
+def read_entries(path, start=None, end=None):
+    """
+    Поток записей файла в интервале [start, end): (время, тег, камера, сообщение, строка).
+    В обычном файле начало ищется бинарным поиском, в сжатом - пропуском строк
+    """
+    compressed = is_compressed(path)
+    with open_log(path) as f:
+        if start is not None and not compressed:
+            seek_time(f, start)
+        for raw in f:
+            line = raw.decode("utf-8", "replace")
+            entry = parse_entry(line)
+            if entry is None:
+                continue
+            if compressed and start is not None and entry[0] < start:
+                continue
+            if end is not None and entry[0] >= end:
+                return
+            yield (*entry, line.rstrip("\r\n"))
+
+
+def read_tail(f, last, end=None, accept=None, block=64 * 1024):
+    """
+    Последние last подходящих записей файла (открытого в "rb"), читая блоками
+    с конца, пока не наберется нужное число или не кончится файл.
+    Возвращает (записи по возрастанию, смещение конца последней целой строки)
+    """
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(0, size - block))
+    head = f.read()
+    # Недописанная последняя строка не выводится - ее дочитает режим ожидания
+    follow_from = size - len(head) + head.rfind(b"\n") + 1
+
+    found = collections.deque()
+    pos = follow_from
+    rest = b""  # начало строки, конец которой уже прочитан
+    while pos > 0 and len(found) < last:
+        chunk_size = min(block, pos)
+        pos -= chunk_size
+        f.seek(pos)
+        lines = (f.read(chunk_size) + rest).split(b"\n")
+        rest = lines.pop(0) if pos > 0 else b""
+        for raw in reversed(lines):
+            line = raw.decode("utf-8", "replace")
+            entry = parse_entry(line)
+            if entry is None or (end is not None and entry[0] >= end):
+                continue
+            entry = (*entry, line.rstrip("\r\n"))
+            if accept is None or accept(entry):
+                found.appendleft(entry)
+                if len(found) >= last:
+                    break
+    return list(found), follow_from
+
+
+def follow_entries(logs_dir, start=None, end=None, poll_interval=0.5, last=None, accept=None):
+    """
+    Режим tail -f: дочитывает самый свежий файл и ждет новых строк,
+    при смене дня переходит на новый файл. В памяти только текущая строка.
+    Один раз, дойдя до конца уже записанного, выдает None.
+    Без start прошлые дни не читаются: из самого свежего файла берутся только
+    last последних записей, прошедших accept (поиском с конца файла)
+    """
+    files = log_files(logs_dir, start)
+    while not files:
+        time.sleep(poll_interval)
+        files = log_files(logs_dir, start)
+    if start is not None:
+        # Прошлые дни интервала читаются обычным образом
+        for _, path in files[:-1]:
+            yield from read_entries(path, start, end)
+    day, path = files[-1]
+    f = None
+    if is_compressed(path):
+        # Сегодняшнего файла еще нет - последний архив читается потоком, ждем новый день
+        if start is not None:
+            yield from read_entries(path, start, end)
+        elif last:
+            tail = collections.deque(maxlen=last)
+            for entry in read_entries(path, None, end):
+                if accept is None or accept(entry):
+                    tail.append(entry)
+            yield from tail
+    else:
+        f = open(path, "rb")
+        if start is not None:
+            seek_time(f, start)
+        else:
+            tail, follow_from = read_tail(f, last, end, accept) if last else ([], f.seek(0, os.SEEK_END))
+            f.seek(follow_from)
+            yield from tail
+    pending = b""
+    caught_up = False
+    try:
+        while True:
+            raw = f.readline() if f is not None else b""
+            if raw:
+                pending += raw
+                if not pending.endswith(b"\n"):
+                    continue  # строка дописана не до конца
+                line, pending = pending.decode("utf-8", "replace"), b""
+                entry = parse_entry(line)
+                if entry is None:
+                    continue
+                if end is not None and entry[0] >= end:
+                    return
+                yield (*entry, line.rstrip("\r\n"))
+                continue
+
+            if not caught_up:
+                caught_up = True
+                yield None
+
+            # Новый день - новый файл (старый к этому моменту дописан)
+            newest = log_files(logs_dir, day)
+            if newest and newest[-1][0] != day:
+                if f is not None:
+                    f.close()
+                day, path = newest[-1]
+                f = open(path, "rb")
+                pending = b""
+                continue
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def entry_filter(cameras=None, tags=None, text=None):
+    """Проверка записи по камерам, тегам и подстроке сообщения"""
+    def accept(entry):
+        _, tag, camera, message, _ = entry
+        if tags and tag not in tags:
+            return False
+        if cameras and camera not in cameras:
+            return False
+        if text and text not in message:
+            return False
+        return True
+    return accept
+
+
+def query(logs_dir, start=None, end=None, cameras=None, tags=None, text=None, follow=False, last=None):
+    """
+    Отфильтрованный поток записей по всем дневным файлам интервала.
+    last в режиме follow без start - сколько последних записей показать до новых
+    """
+    accept = entry_filter(cameras, tags, text)
+    if follow:
+        source = follow_entries(logs_dir, start, end, last=last, accept=accept)
+    else:
+        source = (entry for _, path in log_files(logs_dir, start, end)
+                  for entry in read_entries(path, start, end))
+    for entry in source:
+        if entry is None:
+            yield None  # отметка follow_entries: дальше только новые записи
+            continue
+        if accept(entry):
+            yield entry
+
+
+# ================== ВЫВОД ==================
+
+def make_printer(output_format, stream=sys.stdout):
+    """Функция вывода одной записи в выбранном формате"""
+    if output_format == "json":
+        def write(entry):
+            timestamp, tag, camera, message, _ = entry
+            stream.write(json.dumps({"time": timestamp, "tag": tag.strip("[]"), "camera": camera,
+                                     "message": message}, ensure_ascii=False) + "\n")
+    elif output_format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(["time", "tag", "camera", "message"])
+
+        def write(entry):
+            timestamp, tag, camera, message, _ = entry
+            writer.writerow([timestamp, tag.strip("[]"), "" if camera is None else camera, message])
+    else:
+        def write(entry):
+            stream.write(entry[4] + "\n")
+    return write
+
+
+def main():
+    if len(sys.argv) == 1:
+        view_logs()
+        return
+
+    parser = argparse.ArgumentParser(description="Выборка из логов движения")
+    parser.add_argument("--from", dest="start", type=parse_time,
+                        help='начало: "YYYY-MM-DD[ HH:MM[:SS]]", "HH:MM" или "2h" (назад)')
+    parser.add_argument("--to", dest="end", type=parse_time, help="конец (не включая), те же форматы")
+    parser.add_argument("--camera", type=int, nargs="+", help="номера камер")
+    parser.add_argument("--tag", nargs="+", help="теги: MOTION TRIGGER OBJECT SUMMARY SYSTEM ...")
+    parser.add_argument("--grep", help="подстрока в тексте сообщения")
+    parser.add_argument("--format", choices=("text", "json", "csv"), default="text")
+    parser.add_argument("-n", "--last", type=int, help="только последние N совпадений")
+    parser.add_argument("-f", "--follow", action="store_true", help="ждать новых записей (tail -f)")
+    parser.add_argument("--dir", default=LOGS_DIR, help="каталог логов")
+    args = parser.parse_args()
+
+    tags = {f"[{tag.strip('[]').upper()}]" for tag in args.tag} if args.tag else None
+    cameras = set(args.camera) if args.camera else None
+    write = make_printer(args.format)
+
+    # Как tail -f: без начала интервала сначала показываются последние 10 записей
+    last = args.last
+    if args.follow and last is None and args.start is None:
+        last = 10
+
+    try:
+        entries = query(args.dir, args.start, args.end, cameras, tags, args.grep, args.follow, last)
+        tail = collections.deque(maxlen=last) if last else None
+        for entry in entries:
+            if entry is None:
+                # Все уже записанное прочитано - выводим хвост, дальше потоком
+                for tail_entry in tail or ():
+                    write(tail_entry)
+                tail = None
+                sys.stdout.flush()
+            elif tail is not None:
+                tail.append(entry)
+            else:
+                write(entry)
+                if args.follow:
+                    sys.stdout.flush()
+        for entry in tail or ():
+            write(entry)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # Вывод закрыт (например, | head)
+        sys.stderr.close()
+
 
 if __name__ == "__main__":
-    view_logs()
\ No newline at end of file
+    main()